@@ -1,44 +1,120 @@
 
-from flask import Flask, request, jsonify, Blueprint, make_response, session
+from flask import Flask, request, jsonify, Blueprint, make_response, session, Response, stream_with_context, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from src.utils.mongo_db import MongoDB
+from src.utils.mongo_db import get_mongo_db, CHAT_HISTORY_PAGE_SIZE
 from src.middleware.auth_middleware import token_required
+from src.services import ingestion_service, llm_service, prompt_service, upload_service
+from src.services.document_service import validate_and_save_file
+from src.utils import metrics, embeddings, admission
 import requests
 import os
+import json
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from functools import wraps
 
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "https://rag.bixbites.com"}})
+CORS_ORIGIN = "https://rag.bixbites.com"
+CORS(app, resources={r"/*": {"origins": CORS_ORIGIN}})
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
 app.config['UPLOAD_FOLDER'] = os.getenv("UPLOAD_FOLDER", "/tmp/uploads")
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-mongo_db = MongoDB()
+mongo_db = get_mongo_db()
 
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'txt'}
+MAX_CHAT_HISTORY_PAGE_SIZE = 200
+CHAT_CONTEXT_TURNS = int(os.getenv("CHAT_CONTEXT_TURNS", "5"))
+BATCH_CHAT_MAX_QUESTIONS = int(os.getenv("BATCH_CHAT_MAX_QUESTIONS", "500"))
+BATCH_CHAT_CONCURRENCY = int(os.getenv("BATCH_CHAT_CONCURRENCY", "8"))
+
+# Shared by all batch requests so concurrent batches can't multiply upstream LLM load
+batch_llm_pool = ThreadPoolExecutor(max_workers=BATCH_CHAT_CONCURRENCY, thread_name_prefix="batch-llm")
 
 logging.basicConfig(level=logging.INFO)
 
+metrics.registry.callback("rag_llm_cache_hits_total", "LLM response cache hits (in-process tier)",
+                          lambda: llm_service.response_cache.hits, "counter")
+metrics.registry.callback("rag_llm_cache_shared_hits_total", "LLM response cache hits (shared tier)",
+                          lambda: llm_service.response_cache.shared_hits, "counter")
+metrics.registry.callback("rag_llm_cache_misses_total", "LLM response cache misses",
+                          lambda: llm_service.response_cache.misses, "counter")
+metrics.registry.callback("rag_embedding_cache_hits_total", "Embedding cache hits in this process",
+                          lambda: embeddings.get_cache().hits, "counter")
+metrics.registry.callback("rag_embedding_cache_misses_total", "Embedding cache misses in this process",
+                          lambda: embeddings.get_cache().misses, "counter")
+metrics.registry.callback("rag_retrieval_cache_hits_total", "Retrieval cache hits in this process",
+                          lambda: mongo_db.retrieval_cache.hits, "counter")
+metrics.registry.callback("rag_retrieval_cache_misses_total", "Retrieval cache misses in this process",
+                          lambda: mongo_db.retrieval_cache.misses, "counter")
+metrics.registry.callback("rag_retrieval_cache_stale_total", "Retrieval cache entries dropped for an outdated corpus version",
+                          lambda: mongo_db.retrieval_cache.stale, "counter")
+metrics.registry.callback("rag_retrieval_cache_bytes", "Estimated size of the retrieval cache",
+                          lambda: mongo_db.retrieval_cache.bytes)
+for stat, help_text, metric_type in (
+    ("in_flight", "Chat requests holding a model slot", "gauge"),
+    ("queued", "Chat requests waiting for a model slot", "gauge"),
+    ("admitted", "Chat requests admitted", "counter"),
+    ("rejected", "Chat requests shed on arrival", "counter"),
+    ("timed_out", "Chat requests shed after waiting past their budget", "counter")
+):
+    metrics.registry.callback(
+        f"rag_admission_{stat}" + ("_total" if metric_type == "counter" else ""), help_text,
+        lambda stat=stat: llm_service.admission_controller.stats()[stat], metric_type
+    )
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.start_trace()
+
+@app.after_request
+def record_request_metrics(response):
+    # Streaming responses are measured up to the first byte; their LLM stage is still recorded
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)}
+    metrics.request_seconds.observe(elapsed, **labels)
+    metrics.requests_total.inc(**labels)
+    spans = metrics.end_trace()
+    if elapsed * 1000 >= metrics.SLOW_REQUEST_MS:
+        breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in spans) or "no stages"
+        logging.warning(f"Slow request {request.method} {endpoint} took {elapsed * 1000:.0f}ms ({breakdown})")
+    return response
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def error_response(message, code=400):
     return jsonify({'error': message}), code
 
+def overloaded_response(e):
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, e.status
+
+def admit(user_id, model_id, pipeline='chat', priority=admission.PRIORITY_INTERACTIVE):
+    # Raises AdmissionRejected when the model is saturated; the returned ticket must be released
+    with metrics.span('queue', pipeline=pipeline):
+        return llm_service.admission_controller.acquire(model_id, user_id, priority=priority)
+
 def get_user_id():
-    # Example: get user id from session or JWT
-    return session.get('user_id')
+    # Set by token_required from the JWT; fall back to the session
+    return g.get('user_id') or session.get('user_id')
 
 def require_json(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         if not request.is_json:
             return error_response('Request must be JSON', 400)
+        # Handlers call data.get(...), so null, lists and scalars are rejected here as asgi.read_json does
+        if not isinstance(request.get_json(silent=True), dict):
+            return error_response('Request must be a JSON object', 400)
         return f(*args, **kwargs)
     return decorated
 
@@ -68,32 +144,194 @@ def select_model():
         logging.error(f"Error selecting model: {str(e)}")
         return error_response('Failed to select model', 500)
 
+def chat_request_from(data, cache_control=None):
+    # Shared with the ASGI chat routes; prompt_template may be omitted to use the one saved for the user
+    chat_request = {
+        'message': data.get('message'),
+        'context': data.get('context'),
+        'model_id': data.get('model_id'),
+        'prompt_template': data.get('prompt_template'),
+        # Clients can force a fresh completion with {"no_cache": true} or Cache-Control: no-cache
+        'use_cache': not data.get('no_cache') and cache_control != 'no-cache'
+    }
+    if not chat_request['message'] or not chat_request['model_id']:
+        return None
+    return chat_request
+
+def parse_chat_request():
+    chat_request = chat_request_from(request.get_json(), request.headers.get('Cache-Control'))
+    if chat_request is not None and not chat_request['prompt_template']:
+        with metrics.span('template'):
+            chat_request['prompt_template'] = mongo_db.get_user_prompt_template(get_user_id())
+    if chat_request is None or not chat_request['prompt_template']:
+        return None
+    return chat_request
+
+def build_chat_prompt(user_id, chat_request):
+    context = chat_request['context']
+    if context is None:
+        # No client-side context: use the last few turns instead of the full history
+        with metrics.span('history'):
+            turns = mongo_db.get_recent_turns(user_id, CHAT_CONTEXT_TURNS)
+        context = [f"User: {turn['message']}\nAssistant: {turn['response']}" for turn in turns]
+    elif isinstance(context, str):
+        context = [context]
+    # Retrieve relevant docs for RAG
+    with metrics.span('retrieve'):
+        retrieved_docs = mongo_db.retrieve_documents(user_id, chat_request['message'])
+    # Compose prompt within the model's token budget
+    with metrics.span('prompt'):
+        prompt, prompt_tokens = prompt_service.assemble_prompt(
+            chat_request['prompt_template'],
+            chat_request['message'],
+            retrieved_docs,
+            [str(turn) for turn in context],
+            chat_request['model_id']
+        )
+    return retrieved_docs, prompt, prompt_tokens
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.route('/api/chat', methods=['POST'])
 @token_required
 @require_json
 def chat():
-    data = request.get_json()
-    message = data.get('message')
-    context = data.get('context', [])
-    model_id = data.get('model_id')
-    prompt_template = data.get('prompt_template')
+    chat_request = parse_chat_request()
+    if chat_request is None:
+        return error_response('message, model_id, and prompt_template are required', 400)
     user_id = get_user_id()
-    if not message or not model_id or not prompt_template:
+    try:
+        ticket = admit(user_id, chat_request['model_id'])
+    except admission.AdmissionRejected as e:
+        return overloaded_response(e)
+    try:
+        with ticket:
+            retrieved_docs, prompt, prompt_tokens = build_chat_prompt(user_id, chat_request)
+            # Call LLM
+            with metrics.span('llm'):
+                llm_response = llm_service.query_llm(
+                    chat_request['model_id'], prompt, use_cache=chat_request['use_cache']
+                )
+            # Save chat
+            with metrics.span('save'):
+                mongo_db.save_chat(user_id, chat_request['message'], llm_response)
+        return jsonify({
+            'response': llm_response,
+            'retrieved_docs': retrieved_docs,
+            'prompt_tokens': prompt_tokens
+        }), 200
+    except Exception as e:
+        logging.error(f"Error in chat: {str(e)}")
+        return error_response('Failed to process chat', 500)
+
+@app.route('/api/chat/stream', methods=['POST'])
+@token_required
+@require_json
+def chat_stream():
+    chat_request = parse_chat_request()
+    if chat_request is None:
         return error_response('message, model_id, and prompt_template are required', 400)
+    user_id = get_user_id()
     try:
-        # Retrieve relevant docs for RAG
-        retrieved_docs = mongo_db.retrieve_documents(user_id, message)
-        # Compose prompt
-        prompt = prompt_template.format(context=context, docs=retrieved_docs, question=message)
-        # Call LLM
-        llm_response = mongo_db.query_llm(model_id, prompt)
-        # Save chat
-        mongo_db.save_chat(user_id, message, llm_response)
-        return jsonify({'response': llm_response, 'retrieved_docs': retrieved_docs}), 200
+        ticket = admit(user_id, chat_request['model_id'])
+    except admission.AdmissionRejected as e:
+        return overloaded_response(e)
+    try:
+        retrieved_docs, prompt, prompt_tokens = build_chat_prompt(user_id, chat_request)
     except Exception as e:
+        ticket.release()
         logging.error(f"Error in chat: {str(e)}")
         return error_response('Failed to process chat', 500)
 
+    def generate():
+        # Documents go out first so the client can render sources before the first token
+        yield sse_event('docs', {'retrieved_docs': retrieved_docs, 'prompt_tokens': prompt_tokens})
+        parts = []
+        try:
+            with metrics.span('llm_stream'):
+                for token in llm_service.stream_llm(
+                    chat_request['model_id'], prompt, use_cache=chat_request['use_cache']
+                ):
+                    parts.append(token)
+                    yield sse_event('token', {'token': token})
+        except Exception as e:
+            logging.error(f"Error streaming chat: {str(e)}")
+            yield sse_event('error', {'error': 'Failed to process chat'})
+            return
+        llm_response = "".join(parts)
+        with metrics.span('save'):
+            mongo_db.save_chat(user_id, chat_request['message'], llm_response)
+        yield sse_event('done', {'response': llm_response})
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Runs when the stream ends or the client goes away, even if the generator never started
+    response.call_on_close(ticket.release)
+    return response
+
+@app.route('/api/chat/batch', methods=['POST'])
+@token_required
+@require_json
+def chat_batch():
+    # Answers many questions in one call, e.g. for evaluation runs; batch answers are not saved to chat history
+    data = request.get_json()
+    questions = data.get('questions')
+    model_id = data.get('model_id')
+    prompt_template = data.get('prompt_template')
+    context = data.get('context') or []
+    if isinstance(context, str):
+        context = [context]
+    use_cache = not data.get('no_cache') and request.headers.get('Cache-Control') != 'no-cache'
+    if not isinstance(questions, list) or not questions or not model_id or not prompt_template:
+        return error_response('questions (a non-empty list), model_id, and prompt_template are required', 400)
+    if len(questions) > BATCH_CHAT_MAX_QUESTIONS:
+        return error_response(f'At most {BATCH_CHAT_MAX_QUESTIONS} questions per batch', 400)
+    user_id = get_user_id()
+    valid = [i for i, question in enumerate(questions) if isinstance(question, str) and question.strip()]
+    try:
+        # The user's index is loaded once and every question is retrieved in one vectorized pass
+        with metrics.span('retrieve', pipeline='batch'):
+            docs_by_index = dict(zip(valid, mongo_db.retrieve_documents_many(user_id, [questions[i] for i in valid])))
+    except Exception as e:
+        logging.error(f"Error in batch retrieval: {str(e)}")
+        return error_response('Failed to process chat batch', 500)
+
+    def answer(i):
+        retrieved_docs = docs_by_index[i]
+        with metrics.span('prompt', pipeline='batch'):
+            prompt, prompt_tokens = prompt_service.assemble_prompt(
+                prompt_template, questions[i], retrieved_docs, [str(turn) for turn in context], model_id
+            )
+        # Batch questions queue behind interactive chats and are shed first under load
+        ticket = admit(user_id, model_id, pipeline='batch', priority=admission.PRIORITY_BULK)
+        with ticket, metrics.span('llm', pipeline='batch'):
+            llm_response = llm_service.query_llm(model_id, prompt, use_cache=use_cache)
+        return {
+            'question': questions[i],
+            'response': llm_response,
+            'retrieved_docs': retrieved_docs,
+            'prompt_tokens': prompt_tokens
+        }
+
+    futures = {i: batch_llm_pool.submit(answer, i) for i in valid}
+    results = []
+    for i, question in enumerate(questions):
+        if i not in futures:
+            results.append({'question': question, 'error': 'question must be a non-empty string'})
+            continue
+        try:
+            results.append(futures[i].result())
+        except admission.AdmissionRejected as e:
+            results.append({'question': question, 'error': str(e), 'retry_after': e.retry_after})
+        except Exception as e:
+            logging.error(f"Error answering batch question {i}: {str(e)}")
+            results.append({'question': question, 'error': 'Failed to process question'})
+    return jsonify({'results': results}), 200
+
 @app.route('/api/upload-doc', methods=['POST'])
 @token_required
 def upload_doc():
@@ -105,16 +343,99 @@ def upload_doc():
     if not allowed_file(file.filename):
         return error_response('File type not allowed', 400)
     filename = secure_filename(file.filename)
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    user_id = get_user_id()
     try:
-        file.save(file_path)
-        user_id = get_user_id()
-        mongo_db.process_and_index_document(user_id, file_path, filename)
-        return jsonify({'message': 'File uploaded and indexed successfully'}), 201
+        file_path, content_hash, error = validate_and_save_file(file, user_id)
+        if error:
+            return error_response(error, 400)
+        existing = mongo_db.find_document_by_hash(user_id, content_hash)
+        if existing is not None:
+            # Same bytes as a document this user already indexed
+            os.remove(file_path)
+            return jsonify({
+                'message': 'Document already indexed',
+                'duplicate': True,
+                'filename': existing['filename'],
+                'content_hash': content_hash
+            }), 200
+        job_id = ingestion_service.submit_ingestion(user_id, file_path, filename, content_hash)
+        return jsonify({
+            'message': 'File uploaded, indexing queued',
+            'job_id': job_id,
+            'status_url': f'/api/jobs/{job_id}',
+            'content_hash': content_hash
+        }), 202
     except Exception as e:
         logging.error(f"Error uploading file: {str(e)}")
         return error_response('Failed to upload file', 500)
 
+# Chunked uploads: create a session, PUT parts in order (each at most part_size bytes), then complete.
+# GET the session to find the next part after an interruption.
+@app.route('/api/uploads', methods=['POST'])
+@token_required
+@require_json
+def create_upload():
+    data = request.get_json()
+    size = data.get('size')
+    if size is not None and (not isinstance(size, int) or isinstance(size, bool) or size <= 0):
+        return error_response('size must be a positive integer', 400)
+    try:
+        body, created = upload_service.create_upload(get_user_id(), data.get('filename'), size, data.get('sha256'))
+        return jsonify(body), 201 if created else 200
+    except upload_service.UploadError as e:
+        return error_response(str(e), e.status)
+    except Exception as e:
+        logging.error(f"Error creating upload: {str(e)}")
+        return error_response('Failed to create upload', 500)
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+@token_required
+def get_upload(upload_id):
+    try:
+        return jsonify(upload_service.get_upload_status(get_user_id(), upload_id)), 200
+    except upload_service.UploadError as e:
+        return error_response(str(e), e.status)
+    except Exception as e:
+        logging.error(f"Error fetching upload {upload_id}: {str(e)}")
+        return error_response('Failed to fetch upload', 500)
+
+@app.route('/api/uploads/<upload_id>/parts/<int:part_number>', methods=['PUT'])
+@token_required
+def upload_part(upload_id, part_number):
+    try:
+        # request.stream reads the body as it arrives instead of buffering it as form data
+        return jsonify(upload_service.write_part(get_user_id(), upload_id, part_number, request.stream)), 200
+    except upload_service.UploadError as e:
+        return error_response(str(e), e.status)
+    except Exception as e:
+        logging.error(f"Error writing part {part_number} of upload {upload_id}: {str(e)}")
+        return error_response('Failed to store part', 500)
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+@token_required
+def complete_upload(upload_id):
+    try:
+        body, queued = upload_service.complete_upload(get_user_id(), upload_id)
+        return jsonify(body), 202 if queued else 200
+    except upload_service.UploadError as e:
+        return error_response(str(e), e.status)
+    except Exception as e:
+        logging.error(f"Error completing upload {upload_id}: {str(e)}")
+        return error_response('Failed to complete upload', 500)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_job(job_id):
+    user_id = get_user_id()
+    try:
+        job = ingestion_service.get_job_status(job_id, user_id)
+        if job is None:
+            return error_response('Job not found', 404)
+        return jsonify(job), 200
+    except Exception as e:
+        logging.error(f"Error fetching job {job_id}: {str(e)}")
+        return error_response('Failed to fetch job', 500)
+
 @app.route('/api/update-prompt', methods=['POST'])
 @token_required
 @require_json
@@ -136,8 +457,12 @@ def update_prompt():
 def get_chat_history():
     user_id = get_user_id()
     try:
-        history = mongo_db.get_chat_history(user_id)
-        return jsonify({'history': history}), 200
+        limit = min(max(int(request.args.get('limit', CHAT_HISTORY_PAGE_SIZE)), 1), MAX_CHAT_HISTORY_PAGE_SIZE)
+        before = request.args.get('before')
+        history, next_cursor = mongo_db.get_chat_history_page(user_id, limit, before)
+        return jsonify({'history': history, 'next_cursor': next_cursor}), 200
+    except ValueError:
+        return error_response('limit must be an integer and before a cursor from a previous page', 400)
     except Exception as e:
         logging.error(f"Error fetching chat history: {str(e)}")
         return error_response('Failed to fetch chat history', 500)
@@ -153,6 +478,10 @@ def delete_chat_history():
         logging.error(f"Error clearing chat history: {str(e)}")
         return error_response('Failed to clear chat history', 500)
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
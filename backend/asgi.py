@@ -0,0 +1,270 @@
+"""ASGI entry point: the chat routes run natively on asyncio and every other route is served by the Flask app.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+A chat waiting on Mongo or the LLM holds no thread, so one process can keep hundreds in flight.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from app import app, mongo_db, chat_request_from, CHAT_CONTEXT_TURNS, CORS_ORIGIN
+from src.middleware.auth_middleware import decode_user_id
+from src.services import llm_service, prompt_service
+from src.utils import metrics, admission
+from src.utils.async_mongo_db import AsyncMongoDB
+
+# Ranking is numpy work on the synchronous stack, so it runs on a small dedicated pool
+RETRIEVAL_THREADS = int(os.getenv("RETRIEVAL_THREADS", "8"))
+MAX_CHAT_BODY_BYTES = 1024 * 1024
+
+retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS, thread_name_prefix="retrieval")
+async_db = AsyncMongoDB(mongo_db.config_cache)
+flask_application = WsgiToAsgi(app)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, payload, headers=()):
+        super().__init__(payload)
+        self.status = status
+        self.payload = payload
+        self.headers = list(headers)
+
+
+def _headers(scope):
+    return {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+
+def _cors_headers(scope):
+    if _headers(scope).get("origin") == CORS_ORIGIN:
+        return [(b"access-control-allow-origin", CORS_ORIGIN.encode()), (b"vary", b"Origin")]
+    return []
+
+async def send_json(scope, send, status, payload, headers=()):
+    body = app.json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *_cors_headers(scope),
+            *headers
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def read_json(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise asyncio.CancelledError()
+        body += message.get("body", b"")
+        if len(body) > MAX_CHAT_BODY_BYTES:
+            raise HTTPError(413, {"error": "Request body too large"})
+        if not message.get("more_body"):
+            break
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise HTTPError(400, {"error": "Invalid JSON body"})
+    if not isinstance(data, dict):
+        raise HTTPError(400, {"error": "Request must be a JSON object"})
+    return data
+
+async def _in_span(stage, awaitable):
+    with metrics.span(stage):
+        return await awaitable
+
+async def _none():
+    return None
+
+async def admit_chat(scope, receive):
+    # Same checks, in the same order, as token_required, require_json and parse_chat_request
+    headers = _headers(scope)
+    user_id, error = decode_user_id(headers.get("authorization"))
+    if error:
+        raise HTTPError(401, {"message": error})
+    content_type = headers.get("content-type", "").split(";")[0].strip()
+    if content_type != "application/json" and not content_type.endswith("+json"):
+        raise HTTPError(400, {"error": "Request must be JSON"})
+    chat_request = chat_request_from(await read_json(receive), headers.get("cache-control"))
+    if chat_request is None:
+        raise HTTPError(400, {"error": "message, model_id, and prompt_template are required"})
+    try:
+        with metrics.span("queue"):
+            ticket = await llm_service.admission_controller.acquire_async(chat_request["model_id"], user_id)
+    except admission.AdmissionRejected as e:
+        raise HTTPError(
+            e.status, {"error": str(e), "retry_after": e.retry_after}, [(b"retry-after", str(e.retry_after).encode())]
+        )
+    return user_id, chat_request, ticket
+
+async def build_chat_prompt(user_id, chat_request):
+    # Recent turns, the saved template and retrieval don't depend on each other, so they run concurrently
+    context = chat_request["context"]
+    turns, template, retrieved_docs = await asyncio.gather(
+        _in_span("history", async_db.get_recent_turns(user_id, CHAT_CONTEXT_TURNS)) if context is None else _none(),
+        _in_span("template", async_db.get_user_prompt_template(user_id))
+        if not chat_request["prompt_template"] else _none(),
+        _in_span("retrieve", asyncio.get_running_loop().run_in_executor(
+            retrieval_pool, mongo_db.retrieve_documents, user_id, chat_request["message"]
+        ))
+    )
+    if context is None:
+        context = [f"User: {turn['message']}\nAssistant: {turn['response']}" for turn in turns]
+    elif isinstance(context, str):
+        context = [context]
+    template = chat_request["prompt_template"] or template
+    if not template:
+        raise HTTPError(400, {"error": "message, model_id, and prompt_template are required"})
+    with metrics.span("prompt"):
+        prompt, prompt_tokens = prompt_service.assemble_prompt(
+            template, chat_request["message"], retrieved_docs, [str(turn) for turn in context],
+            chat_request["model_id"]
+        )
+    return retrieved_docs, prompt, prompt_tokens
+
+async def chat(scope, receive, send):
+    user_id, chat_request, ticket = await admit_chat(scope, receive)
+    with ticket:
+        try:
+            retrieved_docs, prompt, prompt_tokens = await build_chat_prompt(user_id, chat_request)
+            with metrics.span("llm"):
+                llm_response = await llm_service.query_llm_async(
+                    chat_request["model_id"], prompt, use_cache=chat_request["use_cache"]
+                )
+            with metrics.span("save"):
+                await async_db.save_chat(user_id, chat_request["message"], llm_response)
+        except (HTTPError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            logging.error(f"Error in chat: {str(e)}")
+            raise HTTPError(500, {"error": "Failed to process chat"})
+    await send_json(scope, send, 200, {
+        "response": llm_response,
+        "retrieved_docs": retrieved_docs,
+        "prompt_tokens": prompt_tokens
+    })
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+async def _wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+async def chat_stream(scope, receive, send):
+    user_id, chat_request, ticket = await admit_chat(scope, receive)
+    with ticket:
+        try:
+            retrieved_docs, prompt, prompt_tokens = await build_chat_prompt(user_id, chat_request)
+        except (HTTPError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            logging.error(f"Error in chat: {str(e)}")
+            raise HTTPError(500, {"error": "Failed to process chat"})
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+                *_cors_headers(scope)
+            ]
+        })
+
+        async def stream():
+            # Documents go out first so the client can render sources before the first token
+            await send({"type": "http.response.body", "body": sse_event(
+                "docs", {"retrieved_docs": retrieved_docs, "prompt_tokens": prompt_tokens}
+            ), "more_body": True})
+            parts = []
+            try:
+                with metrics.span("llm_stream"):
+                    async for token in llm_service.stream_llm_async(
+                        chat_request["model_id"], prompt, use_cache=chat_request["use_cache"]
+                    ):
+                        parts.append(token)
+                        await send({"type": "http.response.body", "body": sse_event("token", {"token": token}),
+                                    "more_body": True})
+            except Exception as e:
+                logging.error(f"Error streaming chat: {str(e)}")
+                await send({"type": "http.response.body",
+                            "body": sse_event("error", {"error": "Failed to process chat"})})
+                return
+            llm_response = "".join(parts)
+            with metrics.span("save"):
+                await async_db.save_chat(user_id, chat_request["message"], llm_response)
+            await send({"type": "http.response.body", "body": sse_event("done", {"response": llm_response})})
+
+        # Stop generating (and free the model slot) as soon as the client goes away
+        streamer = asyncio.ensure_future(stream())
+        watcher = asyncio.ensure_future(_wait_for_disconnect(receive))
+        try:
+            await asyncio.wait({streamer, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher.cancel()
+            if not streamer.done():
+                streamer.cancel()
+        if not streamer.cancelled():
+            streamer.result()
+
+ASYNC_ROUTES = {
+    ("POST", "/api/chat"): chat,
+    ("POST", "/api/chat/stream"): chat_stream
+}
+
+async def serve(handler, scope, receive, send):
+    # Request metrics and the slow-request log, as app.py records them for Flask routes
+    started = time.perf_counter()
+    status = {"code": 500}
+
+    async def tracked_send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+        await send(message)
+
+    metrics.start_trace()
+    try:
+        await handler(scope, receive, tracked_send)
+    except HTTPError as e:
+        await send_json(scope, tracked_send, e.status, e.payload, e.headers)
+    except asyncio.CancelledError:
+        status["code"] = 499
+    finally:
+        elapsed = time.perf_counter() - started
+        labels = {"endpoint": scope["path"], "method": scope["method"], "status": str(status["code"])}
+        metrics.request_seconds.observe(elapsed, **labels)
+        metrics.requests_total.inc(**labels)
+        spans = metrics.end_trace()
+        if elapsed * 1000 >= metrics.SLOW_REQUEST_MS:
+            breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in spans) or "no stages"
+            logging.warning(f"Slow request {scope['method']} {scope['path']} took {elapsed * 1000:.0f}ms ({breakdown})")
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await llm_service.close_async_llm_client()
+            await async_db.close()
+            retrieval_pool.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    handler = ASYNC_ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if handler is not None:
+        return await serve(handler, scope, receive, send)
+    # A context per request gives each Flask request its own thread instead of asgiref's single shared one
+    async with ThreadSensitiveContext():
+        await flask_application(scope, receive, send)
@@ -0,0 +1,322 @@
+"""Ingestion and retrieval scaling benchmarks.
+
+Runs against mongomock (default) or a local mongod (--mongodb-uri), with a deterministic hashing
+embedder in place of sentence-transformers unless --embedder model is given, and DummyLLMClient for
+chat. Results are written as JSON so runs can be diffed.
+
+    python benchmarks/run_benchmarks.py --sizes 1000,10000,100000 --output results.json
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Configure before any src module reads its settings
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-not-for-production")
+os.environ.setdefault("EMBEDDING_CACHE_DIR", "")
+os.environ.setdefault("CHAT_WRITE_BEHIND", "true")
+# Time the ranking itself; set a size explicitly to benchmark with the retrieval cache
+os.environ.setdefault("RETRIEVAL_CACHE_MAX_BYTES", "0")
+
+# mongomock answers a keyword query by scanning postings in Python, about a second per query at 1k chunks
+MONGOMOCK_KEYWORD_MAX_CHUNKS = 1000
+ALL_MODES = "vector,keyword,hybrid"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma-separated retrieval corpus sizes in chunks (up to 1000000)")
+    parser.add_argument("--ingest-sizes", default="1000,5000",
+                        help="comma-separated chunk counts pushed through the full file ingestion pipeline")
+    parser.add_argument("--chunk-words", type=int, default=100, help="words per synthetic retrieval chunk")
+    parser.add_argument("--queries", type=int, default=200, help="queries timed per corpus size and mode")
+    parser.add_argument("--modes", default=None,
+                        help=f"retrieval modes to time (default {ALL_MODES} with --mongodb-uri, vector on mongomock)")
+    parser.add_argument("--chat-requests", type=int, default=500, help="total /api/chat requests in the load test")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent /api/chat clients")
+    parser.add_argument("--chat-corpus-size", type=int, default=10000, help="corpus size behind the chat load test")
+    parser.add_argument("--vocab-size", type=int, default=50000)
+    parser.add_argument("--embedder", choices=["hash", "model"], default="hash",
+                        help="hash: fast deterministic stand-in; model: the configured sentence-transformers model")
+    parser.add_argument("--mongodb-uri", default=None, help="use this mongod instead of mongomock (no TLS)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+    if args.modes is None:
+        args.modes = ALL_MODES if args.mongodb_uri else "vector"
+    modes = {mode.strip() for mode in args.modes.split(",")}
+    if not args.mongodb_uri and modes & {"keyword", "hybrid"} and max(parse_sizes(args.sizes)) > MONGOMOCK_KEYWORD_MAX_CHUNKS:
+        parser.error(f"keyword and hybrid modes need --mongodb-uri above {MONGOMOCK_KEYWORD_MAX_CHUNKS} chunks")
+    return args
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(q / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def latency_summary(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p90_ms": percentile(samples, 90) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+class SyntheticCorpus:
+    """Zipf-distributed word streams over a fixed vocabulary, so BM25 and vector scores behave like text."""
+
+    def __init__(self, vocab_size, seed):
+        import numpy as np
+        self.np = np
+        self.rng = np.random.default_rng(seed)
+        self.vocab = np.array([f"term{i}" for i in range(vocab_size)])
+        ranks = np.arange(1, vocab_size + 1)
+        weights = 1.0 / ranks ** 1.1
+        self.probabilities = weights / weights.sum()
+
+    def words(self, count):
+        return self.vocab[self.rng.choice(len(self.vocab), size=count, p=self.probabilities)]
+
+    def chunks(self, count, words_per_chunk):
+        words = self.words(count * words_per_chunk).reshape(count, words_per_chunk)
+        return [" ".join(row) for row in words]
+
+    def query_from(self, text, length=4):
+        words = text.split()
+        start = int(self.rng.integers(0, max(1, len(words) - length)))
+        return " ".join(words[start:start + length])
+
+
+def install_hash_embedder(embeddings, dim):
+    import numpy as np
+
+    def encode(texts, batch_size=embeddings.EMBEDDING_BATCH_SIZE):
+        texts = list(texts)
+        vectors = np.zeros((len(texts), dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.split():
+                # crc32 rather than hash() so vectors do not change with PYTHONHASHSEED
+                digest = zlib.crc32(word.encode("utf-8"))
+                vectors[row, digest % dim] += 1.0 if digest >> 31 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    embeddings.encode = encode
+    embeddings.encode_query = lambda query: encode([query])[0]
+
+
+def setup_backend(args):
+    if args.mongodb_uri:
+        os.environ["MONGODB_URI"] = args.mongodb_uri
+        os.environ["MONGODB_TLS"] = "false"
+    else:
+        # The chat load test retrieves on every request, so keep it off mongomock's keyword scan
+        os.environ.setdefault("RETRIEVAL_MODE", "vector")
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+    from src.utils import embeddings, mongo_db
+    if not args.mongodb_uri:
+        mongo_db.MongoClient = mongomock.MongoClient
+    if args.embedder == "hash":
+        install_hash_embedder(embeddings, embeddings.EMBEDDING_DIM)
+    return embeddings, mongo_db
+
+
+def seed_corpus(db, embeddings, corpus, user_id, size, words_per_chunk, batch_size=1000):
+    # Same write path as ingestion (bulk chunk insert + postings), minus file parsing
+    texts = []
+    started = time.perf_counter()
+    for start in range(0, size, batch_size):
+        batch = corpus.chunks(min(batch_size, size - start), words_per_chunk)
+        vectors = embeddings.encode(batch)
+        doc_chunks = [
+            {
+                "user_id": user_id,
+                "file_path": "synthetic",
+                "chunk_id": f"synthetic_{start + offset}",
+                "text": text,
+                "embedding": embeddings.pack_embedding(vector),
+                "embedding_dtype": embeddings.EMBEDDING_STORAGE_DTYPE
+            }
+            for offset, (text, vector) in enumerate(zip(batch, vectors))
+        ]
+        db.index_document_chunks(doc_chunks)
+        db.index_chunk_terms(user_id, doc_chunks)
+        # Keep a sample of texts to draw queries from
+        texts.extend(batch[:10])
+    return texts, time.perf_counter() - started
+
+
+def bench_ingest(args, corpus, document_service):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in parse_sizes(args.ingest_sizes):
+            # chunk_text windows are 500 words advancing by 450
+            path = os.path.join(tmp, f"synthetic_{size}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                for start in range(0, size * 450 + 50, 10000):
+                    f.write(" ".join(corpus.words(min(10000, size * 450 + 50 - start))) + "\n")
+            timings = {}
+            started = time.perf_counter()
+            ok = document_service.process_and_index_document(path, f"ingest-{size}", stage_timings=timings)
+            elapsed = time.perf_counter() - started
+            results.append({
+                "chunks": size,
+                "ok": ok,
+                "seconds": elapsed,
+                "chunks_per_sec": size / elapsed if elapsed > 0 else None,
+                "stage_seconds": timings,
+                "peak_rss_mb": peak_rss_mb()
+            })
+            log(f"ingest {size} chunks: {elapsed:.2f}s")
+    return results
+
+
+def bench_retrieval(args, corpus, db, embeddings):
+    results = []
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    for size in parse_sizes(args.sizes):
+        user_id = f"retrieval-{size}"
+        texts, seed_seconds = seed_corpus(db, embeddings, corpus, user_id, size, args.chunk_words)
+        queries = [corpus.query_from(texts[i % len(texts)]) for i in range(args.queries)]
+        load_started = time.perf_counter()
+        db.vector_indexes.get(user_id, db.get_corpus_state(user_id))
+        load_seconds = time.perf_counter() - load_started
+        entry = {
+            "chunks": size,
+            "seed_seconds": seed_seconds,
+            "index_load_seconds": load_seconds,
+            "modes": {}
+        }
+        for mode in modes:
+            samples = []
+            for query in queries:
+                started = time.perf_counter()
+                db.retrieve_documents(user_id, query, mode=mode)
+                samples.append(time.perf_counter() - started)
+            entry["modes"][mode] = latency_summary(samples)
+            log(f"retrieval {size} chunks, {mode}: p50 {entry['modes'][mode]['p50_ms']:.2f}ms "
+                f"p99 {entry['modes'][mode]['p99_ms']:.2f}ms")
+        entry["peak_rss_mb"] = peak_rss_mb()
+        results.append(entry)
+        # Free this corpus's in-memory index before the next, larger one
+        db.vector_indexes.invalidate(user_id)
+    return results
+
+
+def bench_chat(args, corpus, db, embeddings):
+    import jwt
+    import app as app_module
+    user_id = "chat-load"
+    texts, _ = seed_corpus(db, embeddings, corpus, user_id, args.chat_corpus_size, args.chunk_words)
+    token = jwt.encode({"user_id": user_id}, os.environ["SECRET_KEY"], algorithm="HS256")
+    headers = {"Authorization": f"Bearer {token}"}
+    template = "Context:\n{context}\n\nDocuments:\n{docs}\n\nQuestion: {question}"
+    local = threading.local()
+
+    def one_request(i):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app_module.app.test_client()
+        payload = {
+            "message": corpus.query_from(texts[i % len(texts)]) + f" #{i}",
+            "model_id": "gpt-4",
+            "prompt_template": template,
+            "context": []
+        }
+        started = time.perf_counter()
+        response = client.post("/api/chat", json=payload, headers=headers)
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(one_request, range(args.chat_requests)))
+    wall = time.perf_counter() - started
+    app_module.mongo_db.chat_writer and app_module.mongo_db.chat_writer.flush()
+    samples = [elapsed for elapsed, _ in outcomes]
+    errors = sum(1 for _, status in outcomes if status != 200)
+    summary = latency_summary(samples)
+    summary.update({
+        "corpus_chunks": args.chat_corpus_size,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "requests_per_sec": len(samples) / wall if wall > 0 else None,
+        "peak_rss_mb": peak_rss_mb()
+    })
+    log(f"chat x{args.concurrency}: p50 {summary['p50_ms']:.2f}ms p99 {summary['p99_ms']:.2f}ms, "
+        f"{summary['requests_per_sec']:.1f} req/s, {errors} errors")
+    return summary
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(",") if size.strip()]
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def main():
+    args = parse_args()
+    embeddings, mongo_db = setup_backend(args)
+    from src.services import document_service
+    db = mongo_db.get_mongo_db()
+    corpus = SyntheticCorpus(args.vocab_size, args.seed)
+    results = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": "mongod" if args.mongodb_uri else "mongomock",
+        "embedder": args.embedder,
+        "chat_retrieval_mode": mongo_db.RETRIEVAL_MODE,
+        "config": vars(args),
+        "ingest": bench_ingest(args, corpus, document_service),
+        "retrieval": bench_retrieval(args, corpus, db, embeddings),
+        "chat": bench_chat(args, corpus, db, embeddings),
+        "peak_rss_mb": peak_rss_mb()
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        log(f"wrote {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,24 +9,29 @@ load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 
+def decode_user_id(authorization):
+    # Returns (user_id, error) for an Authorization header value; shared with the ASGI chat routes
+    token = authorization.split(" ")[1] if authorization and " " in authorization else None
+    if not token:
+        return None, 'Token is missing!'
+    try:
+        data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        return data['user_id'], None
+    except jwt.ExpiredSignatureError:
+        return None, 'Token has expired!'
+    except jwt.InvalidTokenError:
+        return None, 'Invalid token!'
+
 def jwt_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers:
-            token = request.headers['Authorization'].split(" ")[1]
-        
-        if not token:
-            return jsonify({'message': 'Token is missing!'}), 401
-        
-        try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            g.user_id = data['user_id']
-        except jwt.ExpiredSignatureError:
-            return jsonify({'message': 'Token has expired!'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'message': 'Invalid token!'}), 401
-        
+        user_id, error = decode_user_id(request.headers.get('Authorization'))
+        if error:
+            return jsonify({'message': error}), 401
+        g.user_id = user_id
         return f(*args, **kwargs)
     
     return decorated_function
+
+# Name used by the route decorators in app.py
+token_required = jwt_required
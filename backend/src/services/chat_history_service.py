@@ -1,12 +1,13 @@
 
 import logging
-from src.utils.mongo_db import MongoDB
+from typing import Optional
+from src.utils.mongo_db import get_mongo_db, CHAT_HISTORY_PAGE_SIZE
 
-mongo_db = MongoDB()
+mongo_db = get_mongo_db()
 
-def get_chat_history(user_id: str):
+def get_chat_history(user_id: str, limit: int = CHAT_HISTORY_PAGE_SIZE, before: Optional[str] = None):
     try:
-        history = mongo_db.get_chat_history(user_id)
+        history = mongo_db.get_chat_history(user_id, limit, before)
         logging.info(f"Retrieved chat history for user {user_id}.")
         return history
     except Exception as e:
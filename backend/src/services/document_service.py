@@ -2,90 +2,199 @@
 import os
 import logging
 import uuid
+import hashlib
+import time
 from werkzeug.utils import secure_filename
-from typing import List, Tuple, Any
+from typing import List, Tuple, Any, Callable, Optional, Iterable, Iterator, Dict
 from PyPDF2 import PdfReader
 import docx
-from src.utils.mongo_db import MongoDB
+from src.utils.mongo_db import get_mongo_db
+from src.utils import embeddings
 
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'txt'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+MAX_TEXT_SEGMENT = 1024 * 1024  # flush a txt paragraph once it grows past 1MB
+STREAM_BLOCK_SIZE = 64 * 1024
+# Words per chunk and words shared by consecutive chunks; changing either calls for a re-index
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+# iter_chunks advances by CHUNK_SIZE - CHUNK_OVERLAP words, so anything else would never finish a document
+if CHUNK_SIZE <= 0 or not 0 <= CHUNK_OVERLAP < CHUNK_SIZE:
+    raise ValueError(
+        f"CHUNK_SIZE must be positive and 0 <= CHUNK_OVERLAP < CHUNK_SIZE (got CHUNK_SIZE={CHUNK_SIZE}, "
+        f"CHUNK_OVERLAP={CHUNK_OVERLAP})"
+    )
 
-mongo_db = MongoDB()
+mongo_db = get_mongo_db()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def validate_and_save_file(file, user_id) -> Tuple[str, str]:
+def copy_stream(stream, out, hasher=None, limit: Optional[int] = None) -> int:
+    # Copies block by block, feeding each block to `hasher` on the way; raises once more than `limit` bytes arrive
+    written = 0
+    while True:
+        block = stream.read(STREAM_BLOCK_SIZE)
+        if not block:
+            return written
+        written += len(block)
+        if limit is not None and written > limit:
+            raise ValueError(f"Stream exceeds {limit} bytes")
+        if hasher is not None:
+            hasher.update(block)
+        out.write(block)
+
+def save_stream(stream, file_path: str, hasher=None) -> int:
+    with open(file_path, "wb") as f:
+        return copy_stream(stream, f, hasher)
+
+def validate_and_save_file(file, user_id) -> Tuple[str, str, str]:
+    # Returns (file_path, content_hash, error); the sha256 is computed while the file is written
     try:
         filename = secure_filename(file.filename)
         if not allowed_file(filename):
-            return None, "File type not allowed"
+            return None, None, "File type not allowed"
         file.seek(0, os.SEEK_END)
         file_length = file.tell()
         file.seek(0)
         if file_length > MAX_FILE_SIZE:
-            return None, "File size exceeds limit"
+            return None, None, "File size exceeds limit"
         user_folder = os.path.join(os.getenv("UPLOAD_FOLDER", "/tmp/uploads"), str(user_id))
         os.makedirs(user_folder, exist_ok=True)
         unique_filename = f"{uuid.uuid4().hex}_{filename}"
         file_path = os.path.join(user_folder, unique_filename)
-        file.save(file_path)
+        hasher = hashlib.sha256()
+        save_stream(file.stream, file_path, hasher)
         logging.info(f"File saved: {file_path}")
-        return file_path, None
+        return file_path, hasher.hexdigest(), None
     except Exception as e:
         logging.error(f"Error saving file: {str(e)}")
-        return None, str(e)
+        return None, None, str(e)
 
-def extract_text_from_file(file_path: str) -> str:
+def iter_text_from_file(file_path: str) -> Iterator[str]:
     ext = file_path.rsplit('.', 1)[1].lower()
     try:
         if ext == 'pdf':
-            text = ""
             with open(file_path, "rb") as f:
                 reader = PdfReader(f)
                 for page in reader.pages:
-                    text += page.extract_text() or ""
-            return text
+                    yield page.extract_text() or ""
         elif ext == 'docx':
             doc = docx.Document(file_path)
-            return "\n".join([para.text for para in doc.paragraphs])
+            for para in doc.paragraphs:
+                yield para.text
         elif ext == 'txt':
             with open(file_path, "r", encoding="utf-8") as f:
-                return f.read()
+                paragraph = []
+                size = 0
+                for line in f:
+                    paragraph.append(line)
+                    size += len(line)
+                    if not line.strip() or size >= MAX_TEXT_SEGMENT:
+                        yield "".join(paragraph)
+                        paragraph = []
+                        size = 0
+                if paragraph:
+                    yield "".join(paragraph)
         else:
             raise ValueError("Unsupported file type")
     except Exception as e:
         logging.error(f"Error extracting text: {str(e)}")
         raise
 
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-    words = text.split()
-    chunks = []
-    i = 0
-    while i < len(words):
-        chunk = words[i:i+chunk_size]
-        chunks.append(" ".join(chunk))
-        i += chunk_size - overlap
-    return chunks
-
-def process_and_index_document(file_path: str, user_id: str) -> bool:
+def extract_text_from_file(file_path: str) -> str:
+    return "\n".join(iter_text_from_file(file_path))
+
+def iter_chunks(segments: Iterable[str], chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    # Sliding window over the word stream; the overlap carries across page boundaries
+    step = chunk_size - overlap
+    window = []
+    for segment in segments:
+        window.extend(segment.split())
+        while len(window) >= chunk_size:
+            yield " ".join(window[:chunk_size])
+            del window[:step]
+    while window:
+        yield " ".join(window[:chunk_size])
+        del window[:step]
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    return list(iter_chunks([text], chunk_size, overlap))
+
+INGEST_STAGES = ("extract", "chunk", "embed", "insert")
+
+def _timed_iter(iterable: Iterable[str], timings: Dict[str, float], stage: str) -> Iterator[str]:
+    # Charges the time spent producing each item to `stage`
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            timings[stage] += time.perf_counter() - started
+            return
+        timings[stage] += time.perf_counter() - started
+        yield item
+
+def build_doc_chunks(file_path: str, user_id: str, batch: List[str], start: int,
+                     batch_size: int = embeddings.EMBEDDING_BATCH_SIZE) -> List[Dict[str, Any]]:
+    base_name = os.path.basename(file_path)
+    vectors = embeddings.encode_cached(batch, batch_size=batch_size)
+    return [
+        {
+            "user_id": user_id,
+            "file_path": file_path,
+            "chunk_id": f"{base_name}_{start + offset}",
+            "text": chunk,
+            "embedding": embeddings.pack_embedding(vector),
+            "embedding_dtype": embeddings.EMBEDDING_STORAGE_DTYPE
+        }
+        for offset, (chunk, vector) in enumerate(zip(batch, vectors))
+    ]
+
+def _index_chunk_batch(file_path: str, user_id: str, batch: List[str], start: int, batch_size: int,
+                       timings: Dict[str, float]) -> None:
+    started = time.perf_counter()
+    doc_chunks = build_doc_chunks(file_path, user_id, batch, start, batch_size)
+    embedded = time.perf_counter()
+    mongo_db.index_document_chunks(doc_chunks)
+    mongo_db.index_chunk_terms(user_id, doc_chunks)
+    timings["embed"] += embedded - started
+    timings["insert"] += time.perf_counter() - embedded
+
+def process_and_index_document(file_path: str, user_id: str, batch_size: int = embeddings.EMBEDDING_BATCH_SIZE,
+                               progress_callback: Optional[Callable[[int, Optional[int]], None]] = None,
+                               stage_timings: Optional[Dict[str, float]] = None) -> bool:
+    # stage_timings, when given, is filled with seconds spent per stage in INGEST_STAGES
+    timings = stage_timings if stage_timings is not None else {}
+    timings.update({stage: 0.0 for stage in INGEST_STAGES})
     try:
-        text = extract_text_from_file(file_path)
-        if not text.strip():
+        started = time.perf_counter()
+        indexed = 0
+        batch = []
+        # Chunks are indexed batch by batch while later pages are still being parsed
+        pages = _timed_iter(iter_text_from_file(file_path), timings, "extract")
+        for chunk in _timed_iter(iter_chunks(pages), timings, "chunk"):
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                _index_chunk_batch(file_path, user_id, batch, indexed, batch_size, timings)
+                indexed += len(batch)
+                batch = []
+                if progress_callback:
+                    progress_callback(indexed, None)
+        if batch:
+            _index_chunk_batch(file_path, user_id, batch, indexed, batch_size, timings)
+            indexed += len(batch)
+        # The chunk iterator's time includes pulling pages from the extractor
+        timings["chunk"] -= timings["extract"]
+        if indexed == 0:
             raise ValueError("No text extracted from document")
-        chunks = chunk_text(text)
-        # Store each chunk in DB with embeddings (dummy embedding for now)
-        for idx, chunk in enumerate(chunks):
-            doc_chunk = {
-                "user_id": user_id,
-                "file_path": file_path,
-                "chunk_id": f"{os.path.basename(file_path)}_{idx}",
-                "text": chunk,
-                "embedding": [0.0] * 768  # Replace with real embedding
-            }
-            mongo_db.index_document_chunk(doc_chunk)
-        logging.info(f"Indexed {len(chunks)} chunks for {file_path}")
+        if progress_callback:
+            progress_callback(indexed, indexed)
+        elapsed = time.perf_counter() - started
+        rate = indexed / elapsed if elapsed > 0 else float("inf")
+        breakdown = ", ".join(f"{stage} {timings[stage]:.2f}s" for stage in INGEST_STAGES)
+        logging.info(f"Indexed {indexed} chunks for {file_path} in {elapsed:.2f}s ({rate:.1f} chunks/sec; {breakdown})")
         return True
     except Exception as e:
         logging.error(f"Error processing and indexing document: {str(e)}")
@@ -93,15 +202,10 @@ def process_and_index_document(file_path: str, user_id: str) -> bool:
 
 def retrieve_relevant_chunks(query: str, user_id: str, top_k: int = 5) -> List[Any]:
     try:
-        # For now, use keyword search; replace with semantic search as needed
-        chunks = mongo_db.get_document_chunks(user_id)
-        scored = []
-        for chunk in chunks:
-            score = chunk['text'].lower().count(query.lower())
-            if score > 0:
-                scored.append((score, chunk))
-        scored.sort(reverse=True, key=lambda x: x[0])
-        relevant = [chunk for _, chunk in scored[:top_k]]
+        relevant = [
+            {"user_id": user_id, "chunk_id": chunk_id, "text": text, "score": score}
+            for score, chunk_id, text in mongo_db.search_chunks(user_id, query, top_k)
+        ]
         logging.info(f"Retrieved {len(relevant)} relevant chunks for query: {query}")
         return relevant
     except Exception as e:
@@ -0,0 +1,118 @@
+import os
+import uuid
+import logging
+import datetime
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from src.services import document_service
+from src.utils import metrics
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# A running job reports after every batch; one silent for this long lost its worker (e.g. to a restart)
+INGESTION_JOB_TIMEOUT_SECONDS = int(os.getenv("INGESTION_JOB_TIMEOUT_SECONDS", "600"))
+
+mongo_db = document_service.mongo_db
+
+_executor = None
+_executor_lock = threading.Lock()
+
+ingestion_jobs_total = metrics.registry.counter(
+    "rag_ingestion_jobs_total", "Ingestion jobs finished, by outcome", ["status"]
+)
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Spawned workers build their own Mongo client instead of inheriting the parent's sockets
+                _executor = ProcessPoolExecutor(
+                    max_workers=INGESTION_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return _executor
+
+def _run_ingestion_job(job_id: str, user_id: str, file_path: str):
+    # Runs inside a pool worker process; stage timings go back to the parent, which owns /metrics
+    db = document_service.mongo_db
+    db.update_ingestion_job(job_id, status="running")
+
+    def report_progress(indexed, total):
+        db.update_ingestion_job(job_id, chunks_indexed=indexed, total_chunks=total)
+
+    timings = {}
+    ok = document_service.process_and_index_document(
+        file_path, user_id, progress_callback=report_progress, stage_timings=timings
+    )
+    if ok:
+        db.set_document_status(user_id, file_path, "indexed")
+        db.update_ingestion_job(job_id, status="completed", stage_seconds=timings)
+    else:
+        # Chunks from batches that went in before the failure would otherwise stay searchable
+        db.remove_document_chunks(user_id, file_path)
+        db.set_document_status(user_id, file_path, "failed")
+        db.update_ingestion_job(job_id, status="failed", error="Failed to extract or index document")
+    return ok, timings
+
+def _on_job_done(job_id: str, user_id: str, file_path: str, future) -> None:
+    error = future.exception()
+    if error is not None:
+        # The worker died before it could record the outcome itself
+        logging.error(f"Ingestion job {job_id} crashed: {str(error)}")
+        mongo_db.remove_document_chunks(user_id, file_path)
+        mongo_db.set_document_status(user_id, file_path, "failed")
+        mongo_db.update_ingestion_job(job_id, status="failed", error=str(error))
+        ingestion_jobs_total.inc(status="crashed")
+        return
+    ok, timings = future.result()
+    ingestion_jobs_total.inc(status="completed" if ok else "failed")
+    for stage, seconds in timings.items():
+        metrics.record_stage("ingest", stage, seconds)
+
+def submit_ingestion(user_id: str, file_path: str, filename: str, content_hash: str = None) -> str:
+    job_id = uuid.uuid4().hex
+    mongo_db.store_document_metadata(user_id, file_path, filename, content_hash)
+    mongo_db.create_ingestion_job(job_id, user_id, file_path, filename)
+    future = _get_executor().submit(_run_ingestion_job, job_id, user_id, file_path)
+    future.add_done_callback(lambda f: _on_job_done(job_id, user_id, file_path, f))
+    logging.info(f"Queued ingestion job {job_id} for {file_path}")
+    return job_id
+
+def _expire_stale_job(job):
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=INGESTION_JOB_TIMEOUT_SECONDS)
+    if job["updated_at"] >= cutoff:
+        return job
+    expired = mongo_db.fail_stale_ingestion_job(job["_id"], cutoff, "Indexing stopped responding")
+    if expired is None:
+        return mongo_db.get_ingestion_job(job["_id"], job["user_id"]) or job
+    logging.error(f"Ingestion job {job['_id']} stopped reporting progress; marked failed")
+    mongo_db.remove_document_chunks(expired["user_id"], expired["file_path"])
+    mongo_db.set_document_status(expired["user_id"], expired["file_path"], "failed")
+    ingestion_jobs_total.inc(status="expired")
+    return expired
+
+def get_job_status(job_id: str, user_id: str):
+    job = mongo_db.get_ingestion_job(job_id, user_id)
+    if job is None:
+        return None
+    if job["status"] == "running":
+        job = _expire_stale_job(job)
+    return {
+        "job_id": job["_id"],
+        "filename": job["filename"],
+        "status": job["status"],
+        "chunks_indexed": job["chunks_indexed"],
+        "total_chunks": job["total_chunks"],
+        "error": job["error"],
+        "stage_seconds": job.get("stage_seconds"),
+        "created_at": job["created_at"].isoformat(),
+        "updated_at": job["updated_at"].isoformat()
+    }
+
+def shutdown(wait: bool = True) -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
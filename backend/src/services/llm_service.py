@@ -1,8 +1,20 @@
 
 import os
+import json
+import time
+import random
+import asyncio
 import logging
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import Future
+from typing import List, Dict, Any, Iterator, AsyncIterator
+import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from src.utils.response_cache import ResponseCache
+from src.utils.config_cache import ConfigCache
+from src.utils.admission import AdmissionController
+from src.utils.mongo_db import get_mongo_db
 
 load_dotenv()
 
@@ -24,26 +36,272 @@ class DummyLLMClient:
         # Dummy response; replace with actual API call
         return f"LLM({model_id}) response to: {prompt[:100]}..."
 
+    def generate_stream(self, prompt, model_id):
+        # Dummy token stream; replace with the provider's streaming API
+        response = self.generate(prompt, model_id)
+        for i, token in enumerate(response.split(" ")):
+            yield token if i == 0 else " " + token
+
+class LLMRequestError(Exception):
+    pass
+
+# Client for an OpenAI-compatible completions API
+class HTTPLLMClient:
+    RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+    def __init__(self, api_key, endpoint, pool_size=32, connect_timeout=3.05, read_timeout=60.0,
+                 max_retries=3, backoff_base=0.5, backoff_cap=8.0, max_concurrency_per_model=16):
+        self.api_key = api_key
+        self.endpoint = endpoint.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_concurrency_per_model = max_concurrency_per_model
+        # One keep-alive pool shared by every request thread
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Authorization": f"Bearer {api_key}"})
+        self._semaphores = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def list_models(self):
+        response = self._request("GET", "/v1/models")
+        return [{"id": model["id"], "name": model.get("name", model["id"])} for model in response.json()["data"]]
+
+    def generate(self, prompt, model_id):
+        key = (model_id, prompt)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+        if not leader:
+            # An identical prompt is already upstream; share its result
+            return future.result()
+        try:
+            with self._semaphore(model_id):
+                response = self._request("POST", "/v1/completions", json={"model": model_id, "prompt": prompt})
+            text = response.json()["choices"][0]["text"]
+            future.set_result(text)
+            return text
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def generate_stream(self, prompt, model_id):
+        with self._semaphore(model_id):
+            response = self._request(
+                "POST", "/v1/completions",
+                json={"model": model_id, "prompt": prompt, "stream": True},
+                stream=True
+            )
+            with response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    token = json.loads(payload)["choices"][0].get("text", "")
+                    if token:
+                        yield token
+
+    def _semaphore(self, model_id):
+        with self._lock:
+            semaphore = self._semaphores.get(model_id)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.max_concurrency_per_model)
+                self._semaphores[model_id] = semaphore
+        return semaphore
+
+    def _request(self, method, path, **kwargs):
+        url = self.endpoint + path
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if response.status_code not in self.RETRYABLE_STATUS:
+                    response.raise_for_status()
+                    return response
+                error = LLMRequestError(f"{method} {path} returned {response.status_code}")
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt == self.max_retries:
+                raise error
+            # Full jitter keeps retries from many workers from arriving in lockstep
+            delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            logging.warning(f"LLM request failed ({str(error)}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+class AsyncDummyLLMClient:
+    def __init__(self, api_key, endpoint):
+        self.client = DummyLLMClient(api_key, endpoint)
+
+    async def generate(self, prompt, model_id):
+        return self.client.generate(prompt, model_id)
+
+    async def generate_stream(self, prompt, model_id):
+        for token in self.client.generate_stream(prompt, model_id):
+            yield token
+
+    async def aclose(self):
+        pass
+
+# asyncio counterpart of HTTPLLMClient for the ASGI server: same retries, per-model cap and coalescing
+class AsyncHTTPLLMClient:
+    RETRYABLE_STATUS = HTTPLLMClient.RETRYABLE_STATUS
+
+    def __init__(self, api_key, endpoint, pool_size=32, connect_timeout=3.05, read_timeout=60.0,
+                 max_retries=3, backoff_base=0.5, backoff_cap=8.0, max_concurrency_per_model=16):
+        # Only the async server needs httpx
+        import httpx
+        self.httpx = httpx
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_concurrency_per_model = max_concurrency_per_model
+        self.client = httpx.AsyncClient(
+            base_url=endpoint.rstrip("/"),
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+        self._semaphores = {}
+        self._in_flight = {}
+
+    async def generate(self, prompt, model_id):
+        key = (model_id, prompt)
+        future = self._in_flight.get(key)
+        if future is not None:
+            # An identical prompt is already upstream; share its result
+            return await asyncio.shield(future)
+        future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            async with self._semaphore(model_id):
+                response = await self._request("POST", "/v1/completions", json={"model": model_id, "prompt": prompt})
+            text = response.json()["choices"][0]["text"]
+            future.set_result(text)
+            return text
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else LLMRequestError("Request cancelled"))
+            # Marks the exception as retrieved when no other request was waiting on it
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def generate_stream(self, prompt, model_id):
+        async with self._semaphore(model_id):
+            response = await self._request(
+                "POST", "/v1/completions", json={"model": model_id, "prompt": prompt, "stream": True}, stream=True
+            )
+            try:
+                async for line in response.aiter_lines():
+                    if not line or not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    token = json.loads(payload)["choices"][0].get("text", "")
+                    if token:
+                        yield token
+            finally:
+                await response.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def _semaphore(self, model_id):
+        semaphore = self._semaphores.get(model_id)
+        if semaphore is None:
+            semaphore = self._semaphores[model_id] = asyncio.Semaphore(self.max_concurrency_per_model)
+        return semaphore
+
+    async def _request(self, method, path, stream=False, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = await self.client.send(self.client.build_request(method, path, **kwargs), stream=stream)
+                if response.status_code not in self.RETRYABLE_STATUS:
+                    if response.is_error:
+                        await response.aclose()
+                        response.raise_for_status()
+                    return response
+                error = LLMRequestError(f"{method} {path} returned {response.status_code}")
+                retry_after = response.headers.get("Retry-After")
+                await response.aclose()
+            except self.httpx.TransportError as e:
+                error = e
+            if attempt == self.max_retries:
+                raise error
+            delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            logging.warning(f"LLM request failed ({str(error)}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
 # Dependency injection/configuration
 LLM_API_KEY = os.getenv("LLM_API_KEY", "dummy-key")
 LLM_API_ENDPOINT = os.getenv("LLM_API_ENDPOINT", "https://dummy-llm-endpoint.com")
-llm_client = DummyLLMClient(LLM_API_KEY, LLM_API_ENDPOINT)
+LLM_CLIENT = os.getenv("LLM_CLIENT", "dummy")  # "dummy" or "http"
+
+def _build_llm_client(asynchronous=False):
+    if LLM_CLIENT != "http":
+        return (AsyncDummyLLMClient if asynchronous else DummyLLMClient)(LLM_API_KEY, LLM_API_ENDPOINT)
+    return (AsyncHTTPLLMClient if asynchronous else HTTPLLMClient)(
+        LLM_API_KEY,
+        LLM_API_ENDPOINT,
+        pool_size=int(os.getenv("LLM_POOL_SIZE", "32")),
+        connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "3.05")),
+        read_timeout=float(os.getenv("LLM_READ_TIMEOUT_SECONDS", "60")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+        max_concurrency_per_model=int(os.getenv("LLM_MAX_CONCURRENCY_PER_MODEL", "16"))
+    )
+
+llm_client = _build_llm_client()
+# Built by the ASGI server on its event loop, see get_async_llm_client
+_async_llm_client = None
+
+# Set LLM_CACHE_SHARED=true to share cached responses across workers through Mongo
+LLM_CACHE_SHARED = os.getenv("LLM_CACHE_SHARED", "false").lower() in ("1", "true", "yes")
 
-# Simulated in-memory user model selection (replace with persistent storage)
-_user_model_map = {}
+def _build_response_cache() -> ResponseCache:
+    if not LLM_CACHE_SHARED:
+        return ResponseCache()
+    return ResponseCache(shared_collection_getter=lambda: get_mongo_db().llm_cache_col)
+
+response_cache = _build_response_cache()
+# Chat requests take a slot per model before any work is done for them
+admission_controller = AdmissionController()
+
+# The provider's model catalog rarely changes; avoid an API call per request
+_models_cache = ConfigCache()
 
 def get_available_models() -> List[Dict[str, str]]:
     try:
-        models = llm_client.list_models()
+        models = _models_cache.get("models", llm_client.list_models)
         logging.info("Fetched available LLM models.")
-        return models
+        return list(models)
     except Exception as e:
         logging.error(f"Error fetching models: {str(e)}")
         raise
 
 def set_active_model(user_id: str, model_id: str) -> None:
+    # Stored in Mongo (behind the shared config cache) so every worker sees the same selection
     try:
-        _user_model_map[user_id] = model_id
+        get_mongo_db().set_user_model(user_id, model_id)
         logging.info(f"Set active model for user {user_id}: {model_id}")
     except Exception as e:
         logging.error(f"Error setting active model: {str(e)}")
@@ -51,13 +309,79 @@ def set_active_model(user_id: str, model_id: str) -> None:
 
 def get_active_model(user_id: str) -> str:
     try:
-        model_id = _user_model_map.get(user_id)
+        model_id = get_mongo_db().get_user_model(user_id)
         logging.info(f"Retrieved active model for user {user_id}: {model_id}")
         return model_id
     except Exception as e:
         logging.error(f"Error getting active model: {str(e)}")
         raise
 
+def query_llm(model_id: str, prompt: str, use_cache: bool = True) -> str:
+    if use_cache:
+        cached = response_cache.get(model_id, prompt)
+        if cached is not None:
+            logging.info(f"LLM cache hit for model {model_id}.")
+            return cached
+    response = llm_client.generate(prompt, model_id)
+    # Bypassed requests still refresh the cache with the new answer
+    response_cache.set(model_id, prompt, response)
+    return response
+
+def stream_llm(model_id: str, prompt: str, use_cache: bool = True) -> Iterator[str]:
+    if use_cache:
+        cached = response_cache.get(model_id, prompt)
+        if cached is not None:
+            logging.info(f"LLM cache hit for model {model_id}.")
+            yield cached
+            return
+    parts = []
+    for token in llm_client.generate_stream(prompt, model_id):
+        parts.append(token)
+        yield token
+    # Only completed streams are cached; an abandoned one leaves no partial answer behind
+    response_cache.set(model_id, prompt, "".join(parts))
+
+def get_async_llm_client():
+    global _async_llm_client
+    if _async_llm_client is None:
+        _async_llm_client = _build_llm_client(asynchronous=True)
+    return _async_llm_client
+
+async def close_async_llm_client() -> None:
+    global _async_llm_client
+    if _async_llm_client is not None:
+        await _async_llm_client.aclose()
+        _async_llm_client = None
+
+async def _cache_call(method, *args):
+    # The shared tier reads Mongo with the sync driver, so keep it off the event loop
+    if response_cache.shared_collection_getter is None:
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
+async def query_llm_async(model_id: str, prompt: str, use_cache: bool = True) -> str:
+    if use_cache:
+        cached = await _cache_call(response_cache.get, model_id, prompt)
+        if cached is not None:
+            logging.info(f"LLM cache hit for model {model_id}.")
+            return cached
+    response = await get_async_llm_client().generate(prompt, model_id)
+    await _cache_call(response_cache.set, model_id, prompt, response)
+    return response
+
+async def stream_llm_async(model_id: str, prompt: str, use_cache: bool = True) -> AsyncIterator[str]:
+    if use_cache:
+        cached = await _cache_call(response_cache.get, model_id, prompt)
+        if cached is not None:
+            logging.info(f"LLM cache hit for model {model_id}.")
+            yield cached
+            return
+    parts = []
+    async for token in get_async_llm_client().generate_stream(prompt, model_id):
+        parts.append(token)
+        yield token
+    await _cache_call(response_cache.set, model_id, prompt, "".join(parts))
+
 def generate_response(message: str, context: List[str], model_id: str, prompt_template: str, document_retriever=None) -> str:
     try:
         # Retrieve relevant context if document_retriever is provided
@@ -71,7 +395,7 @@ def generate_response(message: str, context: List[str], model_id: str, prompt_te
             context="\n".join(context + retrieved_context),
             question=message
         )
-        response = llm_client.generate(prompt, model_id)
+        response = query_llm(model_id, prompt)
         logging.info(f"Generated LLM response for user message.")
         return response
     except Exception as e:
@@ -1,8 +1,32 @@
 
+import os
+import re
+import math
 import logging
-from src.utils.mongo_db import MongoDB
+from typing import List, Tuple, Optional
+from src.utils.mongo_db import get_mongo_db
+from src.services.document_service import CHUNK_OVERLAP
 
-mongo_db = MongoDB()
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+mongo_db = get_mongo_db()
+
+# Tokens available for the assembled prompt; the rest of each model's window is left for the answer
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+MODEL_TOKEN_BUDGETS = {
+    "gpt-4": 6000,
+    "llama-2": 3000,
+    "mistral-7b": 6000
+}
+# Share of the budget conversation turns may use before retrieved chunks get the rest
+HISTORY_BUDGET_SHARE = float(os.getenv("PROMPT_HISTORY_BUDGET_SHARE", "0.25"))
+DOC_SEPARATOR = "\n\n"
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_encodings = {}
 
 def update_prompt_template(user_id: str, prompt_template: str) -> bool:
     if not user_id or not prompt_template or not isinstance(prompt_template, str):
@@ -27,3 +51,61 @@ def get_prompt_template(user_id: str) -> str:
     except Exception as e:
         logging.error(f"Error retrieving prompt template for user {user_id}: {str(e)}")
         return ""
+
+def get_token_budget(model_id: str) -> int:
+    return MODEL_TOKEN_BUDGETS.get(model_id, PROMPT_TOKEN_BUDGET)
+
+def count_tokens(text: str, model_id: str) -> int:
+    if tiktoken is not None:
+        encoding = _encodings.get(model_id)
+        if encoding is None:
+            try:
+                encoding = tiktoken.encoding_for_model(model_id)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            _encodings[model_id] = encoding
+        return len(encoding.encode(text))
+    # Without tiktoken: words and punctuation, padded for sub-word splits
+    return math.ceil(len(_TOKEN_RE.findall(text)) * 1.3)
+
+def dedupe_chunks(chunks: List[str], overlap: int = CHUNK_OVERLAP) -> List[str]:
+    # Neighbouring chunks share `overlap` words; keep that text once, in rank order
+    kept = []
+    for chunk in chunks:
+        words = chunk.split()
+        # Padded with spaces so only whole-word runs match, e.g. "cat" is not inside "concatenate"
+        if not words or any(f" {' '.join(words)} " in f" {other} " for other in kept):
+            continue
+        for other in kept:
+            other_words = other.split()
+            if len(words) > overlap and words[:overlap] == other_words[-overlap:]:
+                words = words[overlap:]
+            elif len(words) > overlap and words[-overlap:] == other_words[:overlap]:
+                words = words[:-overlap]
+        kept.append(" ".join(words))
+    return kept
+
+def _pack(items: List[str], model_id: str, budget: int) -> Tuple[List[str], int]:
+    packed = []
+    used = 0
+    for item in items:
+        cost = count_tokens(item + DOC_SEPARATOR, model_id)
+        if used + cost > budget:
+            continue
+        packed.append(item)
+        used += cost
+    return packed, used
+
+def assemble_prompt(prompt_template: str, question: str, chunks: List[str], turns: List[str], model_id: str,
+                    budget: Optional[int] = None) -> Tuple[str, int]:
+    budget = budget or get_token_budget(model_id)
+    remaining = budget - count_tokens(prompt_template.format(context="", docs="", question=question), model_id)
+    # Most recent turns first, then restored to chronological order
+    recent_turns, history_used = _pack(list(reversed(turns)), model_id, int(max(remaining, 0) * HISTORY_BUDGET_SHARE))
+    docs, _ = _pack(dedupe_chunks(chunks), model_id, remaining - history_used)
+    prompt = prompt_template.format(
+        context=DOC_SEPARATOR.join(reversed(recent_turns)),
+        docs=DOC_SEPARATOR.join(docs),
+        question=question
+    )
+    return prompt, count_tokens(prompt, model_id)
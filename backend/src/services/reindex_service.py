@@ -0,0 +1,159 @@
+import os
+import sys
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Optional
+from src.services import document_service
+from src.utils import embeddings, bm25_index
+
+REINDEX_WORKERS = int(os.getenv("REINDEX_WORKERS", str(os.cpu_count() or 1)))
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "/tmp/uploads")
+
+mongo_db = document_service.mongo_db
+
+def resolve_file_path(document: Dict[str, Any]) -> Optional[str]:
+    # Uploads may have moved along with UPLOAD_FOLDER; look for the same file name under it
+    file_path = document["file_path"]
+    if os.path.exists(file_path):
+        return file_path
+    name = os.path.basename(file_path)
+    for candidate in (os.path.join(UPLOAD_FOLDER, str(document["user_id"]), name), os.path.join(UPLOAD_FOLDER, name)):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def _write_shadow_batch(file_path: str, user_id: str, batch, start: int, batch_size: int) -> int:
+    doc_chunks = document_service.build_doc_chunks(file_path, user_id, batch, start, batch_size)
+    postings = []
+    total_length = 0
+    for chunk in doc_chunks:
+        length, chunk_postings = bm25_index.build_postings(user_id, chunk["chunk_id"], chunk["text"])
+        total_length += length
+        postings.extend(chunk_postings)
+    document_service.mongo_db.write_shadow_chunks(doc_chunks, postings)
+    return total_length
+
+def _reindex_document(run_id: str, document: Dict[str, Any], chunk_size: int, overlap: int, batch_size: int) -> bool:
+    # Runs inside a pool worker process and checkpoints its own outcome
+    db = document_service.mongo_db
+    user_id, file_path = document["user_id"], document["file_path"]
+    try:
+        source = resolve_file_path(document)
+        if source is None:
+            raise FileNotFoundError(f"{file_path} not found")
+        db.clear_shadow_document(user_id, file_path)
+        indexed = 0
+        total_length = 0
+        batch = []
+        # Chunks keep the stored file_path so chunk ids match what ingestion would have produced
+        segments = document_service.iter_text_from_file(source)
+        for chunk in document_service.iter_chunks(segments, chunk_size, overlap):
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                total_length += _write_shadow_batch(file_path, user_id, batch, indexed, batch_size)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            total_length += _write_shadow_batch(file_path, user_id, batch, indexed, batch_size)
+            indexed += len(batch)
+        if indexed == 0:
+            raise ValueError("No text extracted from document")
+        db.record_reindex_checkpoint(run_id, user_id, file_path, "done", chunks=indexed, total_length=total_length)
+        return True
+    except Exception as e:
+        logging.error(f"Error re-indexing {file_path}: {str(e)}")
+        db.record_reindex_checkpoint(run_id, user_id, file_path, "failed", error=str(e))
+        return False
+
+def _done_documents(run_id: str):
+    return {
+        (checkpoint["user_id"], checkpoint["file_path"])
+        for checkpoint in mongo_db.get_reindex_checkpoints(run_id)
+        if checkpoint["status"] == "done"
+    }
+
+def run_reindex(workers: int = REINDEX_WORKERS, batch_size: int = embeddings.EMBEDDING_BATCH_SIZE,
+                fresh: bool = False, switch: bool = True, allow_failed: bool = False) -> bool:
+    # Chunking comes from the same CHUNK_SIZE / CHUNK_OVERLAP settings as live ingestion and prompt dedup
+    chunk_size, overlap = document_service.CHUNK_SIZE, document_service.CHUNK_OVERLAP
+    settings = {
+        "chunk_size": chunk_size,
+        "overlap": overlap,
+        "embedding_model": embeddings.EMBEDDING_MODEL,
+        "embedding_dtype": embeddings.EMBEDDING_STORAGE_DTYPE
+    }
+    run = None if fresh else mongo_db.get_open_reindex_run()
+    if run is not None:
+        if run["settings"] != settings:
+            logging.error(f"Unfinished run {run['_id']} used {run['settings']}; pass --fresh to start over with {settings}")
+            return False
+        run_id = run["_id"]
+        logging.info(f"Resuming re-index run {run_id}")
+    else:
+        run_id = mongo_db.start_reindex_run(settings)
+        logging.info(f"Started re-index run {run_id} with {settings}")
+
+    attempted = set()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        while True:
+            # Repeat until no new documents show up, so uploads made during the run are included
+            while True:
+                done = _done_documents(run_id)
+                pending = [
+                    document for document in mongo_db.list_documents()
+                    if (document["user_id"], document["file_path"]) not in done | attempted
+                ]
+                if not pending:
+                    break
+                logging.info(f"Re-indexing {len(pending)} documents ({len(done)} already done)")
+                futures = {
+                    pool.submit(_reindex_document, run_id, document, chunk_size, overlap, batch_size): document
+                    for document in pending
+                }
+                for finished, future in enumerate(as_completed(futures), 1):
+                    document = futures[future]
+                    attempted.add((document["user_id"], document["file_path"]))
+                    if future.exception() is not None:
+                        # The worker died before it could checkpoint; the file is retried on the next run
+                        logging.error(f"Re-index worker crashed on {document['file_path']}: {str(future.exception())}")
+                        mongo_db.record_reindex_checkpoint(
+                            run_id, document["user_id"], document["file_path"], "failed", error=str(future.exception())
+                        )
+                    if finished % 100 == 0 or finished == len(pending):
+                        logging.info(f"Processed {finished}/{len(pending)} documents")
+
+            documents = {(document["user_id"], document["file_path"]) for document in mongo_db.list_documents()}
+            failed = documents - _done_documents(run_id)
+            if failed and not allow_failed:
+                logging.error(f"{len(failed)} documents failed to re-index; fix them and run again, or pass --allow-failed")
+                return False
+            if not switch:
+                logging.info(f"Shadow collections for run {run_id} are ready; run again without --no-switch to activate them")
+                return True
+            # The switch re-checks the document list itself, so nothing uploaded since the pass above is dropped
+            users = mongo_db.switch_to_reindexed(run_id, allow_failed)
+            if users is not None:
+                break
+            logging.info("Documents were uploaded during the final check; re-indexing them before switching")
+    logging.info(f"Switched to re-indexed collections for {users} users")
+    return True
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Rebuild document chunks, embeddings and BM25 postings from the uploaded files"
+    )
+    parser.add_argument("--workers", type=int, default=REINDEX_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=embeddings.EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--fresh", action="store_true", help="discard any unfinished run instead of resuming it")
+    parser.add_argument("--no-switch", action="store_true", help="build the shadow collections but keep serving the old ones")
+    parser.add_argument("--allow-failed", action="store_true", help="switch even if some documents could not be re-indexed")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    ok = run_reindex(args.workers, args.batch_size,
+                     fresh=args.fresh, switch=not args.no_switch, allow_failed=args.allow_failed)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import os
+import re
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Optional, Tuple
+from werkzeug.utils import secure_filename
+from src.services import document_service, ingestion_service
+
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "/tmp/uploads")
+UPLOAD_PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024)))
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", str(1024 * 1024 * 1024)))
+UPLOAD_SWEEP_INTERVAL_SECONDS = int(os.getenv("UPLOAD_SWEEP_INTERVAL_SECONDS", "3600"))
+HASH_STATE_CACHE_SIZE = 1024
+SHA256_PATTERN = re.compile(r"[0-9a-fA-F]{64}")
+
+mongo_db = document_service.mongo_db
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+# Running sha256 per upload, so each part is hashed as it streams in rather than re-read at completion
+_hash_states = OrderedDict()
+_hash_states_lock = threading.Lock()
+_upload_locks = defaultdict(threading.Lock)
+_upload_locks_lock = threading.Lock()
+_last_sweep = 0.0
+_sweep_lock = threading.Lock()
+
+def _upload_lock(upload_id: str) -> threading.Lock:
+    with _upload_locks_lock:
+        return _upload_locks[upload_id]
+
+def _running_hash(upload_id: str, partial_path: str, offset: int):
+    with _hash_states_lock:
+        state = _hash_states.get(upload_id)
+    if state is not None and state[0] == offset:
+        return state[1]
+    # Earlier parts went to another worker, or this one restarted: hash what is already on disk once
+    hasher = hashlib.sha256()
+    if offset:
+        with open(partial_path, "rb") as f:
+            remaining = offset
+            while remaining:
+                block = f.read(min(document_service.STREAM_BLOCK_SIZE, remaining))
+                if not block:
+                    raise UploadError("Upload data is missing on this server; start a new upload", 409)
+                hasher.update(block)
+                remaining -= len(block)
+    return hasher
+
+def _remember_hash(upload_id: str, offset: int, hasher) -> None:
+    with _hash_states_lock:
+        _hash_states[upload_id] = (offset, hasher)
+        _hash_states.move_to_end(upload_id)
+        while len(_hash_states) > HASH_STATE_CACHE_SIZE:
+            _hash_states.popitem(last=False)
+
+def _forget(upload_id: str) -> None:
+    with _hash_states_lock:
+        _hash_states.pop(upload_id, None)
+    with _upload_locks_lock:
+        _upload_locks.pop(upload_id, None)
+
+def sweep_partial_uploads() -> int:
+    # Expired sessions are dropped by a TTL index; their partial files are removed here
+    partials = {}
+    if not os.path.isdir(UPLOAD_FOLDER):
+        return 0
+    for user_dir in os.listdir(UPLOAD_FOLDER):
+        partial_folder = os.path.join(UPLOAD_FOLDER, user_dir, ".partial")
+        if not os.path.isdir(partial_folder):
+            continue
+        for name in os.listdir(partial_folder):
+            if name.endswith(".part"):
+                partials[name[:-len(".part")]] = os.path.join(partial_folder, name)
+    if not partials:
+        return 0
+    live = mongo_db.open_upload_ids(partials)
+    removed = 0
+    for upload_id, partial_path in partials.items():
+        if upload_id in live:
+            continue
+        try:
+            os.remove(partial_path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        _forget(upload_id)
+    if removed:
+        logging.info(f"Removed {removed} abandoned partial uploads")
+    return removed
+
+def _maybe_sweep() -> None:
+    global _last_sweep
+    with _sweep_lock:
+        if time.monotonic() - _last_sweep < UPLOAD_SWEEP_INTERVAL_SECONDS:
+            return
+        _last_sweep = time.monotonic()
+
+    def sweep():
+        try:
+            sweep_partial_uploads()
+        except Exception as e:
+            logging.error(f"Error sweeping partial uploads: {str(e)}")
+
+    threading.Thread(target=sweep, daemon=True).start()
+
+def _duplicate_result(document: Dict[str, Any], content_hash: str) -> Dict[str, Any]:
+    return {
+        "message": "Document already indexed",
+        "duplicate": True,
+        "filename": document["filename"],
+        "content_hash": content_hash
+    }
+
+def _get_session(user_id: str, upload_id: str) -> Dict[str, Any]:
+    session = mongo_db.get_upload_session(upload_id, user_id)
+    if session is None:
+        raise UploadError("Upload not found", 404)
+    return session
+
+def _status(session: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "upload_id": session["_id"],
+        "filename": session["filename"],
+        "status": session["status"],
+        "part_size": session["part_size"],
+        "next_part": session["next_part"],
+        "received_bytes": session["received_bytes"],
+        "size": session.get("size")
+    }
+
+def create_upload(user_id: str, filename: str, size: Optional[int] = None,
+                  content_hash: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+    # Returns (body, created); a client that sends the file's sha256 up front skips uploading known content
+    filename = secure_filename(filename or "")
+    if not document_service.allowed_file(filename):
+        raise UploadError("File type not allowed", 400)
+    if size is not None and size > UPLOAD_MAX_SIZE:
+        raise UploadError(f"File size exceeds limit of {UPLOAD_MAX_SIZE} bytes", 413)
+    if content_hash is not None and (not isinstance(content_hash, str) or not SHA256_PATTERN.fullmatch(content_hash)):
+        raise UploadError("sha256 must be a hex-encoded SHA-256 digest", 400)
+    if content_hash:
+        content_hash = content_hash.lower()
+        document = mongo_db.find_document_by_hash(user_id, content_hash)
+        if document is not None:
+            return _duplicate_result(document, content_hash), False
+    _maybe_sweep()
+    upload_id = uuid.uuid4().hex
+    partial_folder = os.path.join(UPLOAD_FOLDER, str(user_id), ".partial")
+    os.makedirs(partial_folder, exist_ok=True)
+    session = {
+        "_id": upload_id,
+        "user_id": user_id,
+        "filename": filename,
+        "size": size,
+        "expected_hash": content_hash,
+        "part_size": UPLOAD_PART_SIZE,
+        "partial_path": os.path.join(partial_folder, f"{upload_id}.part")
+    }
+    mongo_db.create_upload_session(session)
+    return _status(session), True
+
+def get_upload_status(user_id: str, upload_id: str) -> Dict[str, Any]:
+    return _status(_get_session(user_id, upload_id))
+
+def write_part(user_id: str, upload_id: str, part_number: int, stream) -> Dict[str, Any]:
+    # Parts are appended in order straight from the request stream; resending a received part is a no-op
+    with _upload_lock(upload_id):
+        session = _get_session(user_id, upload_id)
+        if session["status"] != "open":
+            raise UploadError("Upload is already complete", 409)
+        if part_number < session["next_part"]:
+            return _status(session)
+        if part_number > session["next_part"]:
+            raise UploadError(f"Expected part {session['next_part']}", 409)
+        offset = session["received_bytes"]
+        limit = min(session["part_size"], UPLOAD_MAX_SIZE - offset)
+        hasher = _running_hash(upload_id, session["partial_path"], offset).copy()
+        mode = "r+b" if os.path.exists(session["partial_path"]) else "wb"
+        with open(session["partial_path"], mode) as f:
+            # Drop anything a failed attempt at this part left behind
+            f.seek(offset)
+            f.truncate()
+            try:
+                written = document_service.copy_stream(stream, f, hasher, limit)
+            except ValueError:
+                raise UploadError(f"Part exceeds {session['part_size']} bytes or the upload exceeds {UPLOAD_MAX_SIZE}", 413)
+        if written == 0:
+            raise UploadError("Empty part", 400)
+        if not mongo_db.advance_upload_session(upload_id, part_number, written):
+            raise UploadError("Part was recorded by a concurrent request", 409)
+        _remember_hash(upload_id, offset + written, hasher)
+        session.update(next_part=part_number + 1, received_bytes=offset + written)
+        return _status(session)
+
+def complete_upload(user_id: str, upload_id: str) -> Tuple[Dict[str, Any], bool]:
+    # Returns (body, queued); queued is False when the content was already indexed
+    with _upload_lock(upload_id):
+        session = _get_session(user_id, upload_id)
+        if session["status"] != "open":
+            # Completing twice returns the first outcome
+            return session["result"], session["status"] == "completed"
+        received = session["received_bytes"]
+        if received == 0:
+            raise UploadError("No parts uploaded", 400)
+        if session.get("size") is not None and received != session["size"]:
+            raise UploadError(f"Upload incomplete: received {received} of {session['size']} bytes", 400)
+        content_hash = _running_hash(upload_id, session["partial_path"], received).hexdigest()
+        if session.get("expected_hash") and session["expected_hash"] != content_hash:
+            raise UploadError("Checksum mismatch", 400)
+        document = mongo_db.find_document_by_hash(user_id, content_hash)
+        if document is not None:
+            os.remove(session["partial_path"])
+            result = _duplicate_result(document, content_hash)
+            mongo_db.update_upload_session(upload_id, status="duplicate", result=result)
+            _forget(upload_id)
+            logging.info(f"Upload {upload_id} matches an indexed document, skipping ingestion")
+            return result, False
+        file_path = os.path.join(UPLOAD_FOLDER, str(user_id), f"{uuid.uuid4().hex}_{session['filename']}")
+        os.replace(session["partial_path"], file_path)
+        job_id = ingestion_service.submit_ingestion(user_id, file_path, session["filename"], content_hash)
+        result = {
+            "message": "File uploaded, indexing queued",
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+            "content_hash": content_hash
+        }
+        mongo_db.update_upload_session(upload_id, status="completed", result=result)
+        _forget(upload_id)
+        return result, True
@@ -0,0 +1,248 @@
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT_PER_MODEL", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE_PER_MODEL", "32"))
+ADMISSION_MAX_QUEUE_PER_USER = int(os.getenv("ADMISSION_MAX_QUEUE_PER_USER", "4"))
+CHAT_LATENCY_BUDGET_SECONDS = float(os.getenv("CHAT_LATENCY_BUDGET_SECONDS", "30"))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Weight of the newest observation in the moving average of service time
+SERVICE_TIME_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message, retry_after, status=503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+
+class _Waiter:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.event = threading.Event()
+        self.granted = False
+
+    def grant(self):
+        self.granted = True
+        self.event.set()
+
+
+class _AsyncWaiter:
+    # Granted from whichever thread releases the slot, so the future is resolved on its own loop
+    def __init__(self, user_id, loop):
+        self.user_id = user_id
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+    def grant(self):
+        self.granted = True
+        self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class _ModelState:
+    def __init__(self):
+        self.in_flight = 0
+        self.queued = 0
+        self.service_time = None
+        # Per priority: users with queued requests in round-robin order, and each user's FIFO of waiters
+        self.rotation = {PRIORITY_INTERACTIVE: deque(), PRIORITY_BULK: deque()}
+        self.waiters = {PRIORITY_INTERACTIVE: {}, PRIORITY_BULK: {}}
+        self.queued_by_user = {}
+
+
+class Ticket:
+    """An admitted request's slot; release it exactly once when the request is done."""
+
+    def __init__(self, controller, model_id, waited):
+        self.controller = controller
+        self.model_id = model_id
+        self.waited = waited
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self.model_id, time.monotonic() - self.started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """Bounds concurrent requests per model and queues the overflow with deadlines.
+
+    At most `max_in_flight` requests per model run at once. Up to `max_queue` more wait, no more than
+    `max_queue_per_user` of them from one user, and freed slots go round-robin across waiting users so a
+    single heavy user cannot starve the rest. Interactive requests are served before bulk ones, and bulk
+    requests are shed once the queue is half full. A request whose estimated wait plus service time
+    exceeds its latency budget is rejected immediately rather than after timing out.
+    """
+
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT, max_queue=ADMISSION_MAX_QUEUE,
+                 max_queue_per_user=ADMISSION_MAX_QUEUE_PER_USER):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self._models = {}
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def acquire(self, model_id, user_id, budget=CHAT_LATENCY_BUDGET_SECONDS, priority=PRIORITY_INTERACTIVE):
+        started = time.monotonic()
+        waiter = _Waiter(user_id)
+        ticket, timeout = self._enqueue(model_id, user_id, budget, priority, waiter)
+        if ticket is not None:
+            return ticket
+        waiter.event.wait(max(0.0, timeout - (time.monotonic() - started)))
+        return self._finish_wait(model_id, priority, waiter, started)
+
+    async def acquire_async(self, model_id, user_id, budget=CHAT_LATENCY_BUDGET_SECONDS,
+                            priority=PRIORITY_INTERACTIVE):
+        # Same policy as acquire, but waiting suspends the coroutine instead of blocking a thread
+        started = time.monotonic()
+        waiter = _AsyncWaiter(user_id, asyncio.get_running_loop())
+        ticket, timeout = self._enqueue(model_id, user_id, budget, priority, waiter)
+        if ticket is not None:
+            return ticket
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max(0.0, timeout - (time.monotonic() - started)))
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # The client went away while queued; hand back a slot granted in the meantime
+            with self._lock:
+                if not waiter.granted:
+                    self._remove_waiter(self._models[model_id], priority, waiter)
+                    raise
+            self._release(model_id, None)
+            raise
+        return self._finish_wait(model_id, priority, waiter, started)
+
+    def _enqueue(self, model_id, user_id, budget, priority, waiter):
+        # Returns (ticket, None) when admitted at once, or (None, seconds to wait) once queued
+        with self._lock:
+            state = self._models.setdefault(model_id, _ModelState())
+            if state.in_flight < self.max_in_flight and state.queued == 0:
+                state.in_flight += 1
+                self.admitted += 1
+                return Ticket(self, model_id, 0.0), None
+            service_time = state.service_time or 0.0
+            expected_wait = self._expected_wait(state, state.queued + 1)
+            retry_after = max(1, math.ceil(expected_wait))
+            queue_limit = self.max_queue if priority == PRIORITY_INTERACTIVE else self.max_queue // 2
+            if state.queued >= queue_limit:
+                self.rejected += 1
+                raise AdmissionRejected(f"Too many requests queued for {model_id}", retry_after)
+            if state.queued_by_user.get(user_id, 0) >= self.max_queue_per_user:
+                self.rejected += 1
+                raise AdmissionRejected("Too many of your requests are already queued", retry_after, status=429)
+            if expected_wait + service_time > budget:
+                self.rejected += 1
+                raise AdmissionRejected(f"{model_id} cannot answer within the latency budget", retry_after)
+            user_waiters = state.waiters[priority].get(user_id)
+            if user_waiters is None:
+                user_waiters = state.waiters[priority][user_id] = deque()
+                state.rotation[priority].append(user_id)
+            user_waiters.append(waiter)
+            state.queued += 1
+            state.queued_by_user[user_id] = state.queued_by_user.get(user_id, 0) + 1
+            # Leave enough of the budget to actually serve the request once admitted
+            return None, budget - service_time
+
+    def _finish_wait(self, model_id, priority, waiter, started):
+        with self._lock:
+            state = self._models[model_id]
+            if not waiter.granted:
+                self._remove_waiter(state, priority, waiter)
+                self.timed_out += 1
+                raise AdmissionRejected(
+                    f"Timed out waiting for {model_id}", max(1, math.ceil(self._expected_wait(state, state.queued)))
+                )
+            self.admitted += 1
+        return Ticket(self, model_id, time.monotonic() - started)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": sum(state.in_flight for state in self._models.values()),
+                "queued": sum(state.queued for state in self._models.values()),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out
+            }
+
+    def _expected_wait(self, state, position):
+        # Without a measured service time yet, assume a queued request is served quickly
+        if not state.service_time:
+            return 0.0
+        return math.ceil(position / self.max_in_flight) * state.service_time
+
+    def _release(self, model_id, elapsed):
+        # elapsed is None for a slot handed back unused
+        with self._lock:
+            state = self._models[model_id]
+            if elapsed is None:
+                pass
+            elif state.service_time is None:
+                state.service_time = elapsed
+            else:
+                state.service_time += SERVICE_TIME_ALPHA * (elapsed - state.service_time)
+            waiter = self._next_waiter(state)
+            if waiter is None:
+                state.in_flight -= 1
+                return
+            # The slot passes straight to the waiter, so in_flight is unchanged
+            waiter.grant()
+
+    def _next_waiter(self, state):
+        for priority in (PRIORITY_INTERACTIVE, PRIORITY_BULK):
+            rotation = state.rotation[priority]
+            if not rotation:
+                continue
+            user_id = rotation.popleft()
+            user_waiters = state.waiters[priority][user_id]
+            waiter = user_waiters.popleft()
+            if user_waiters:
+                rotation.append(user_id)
+            else:
+                del state.waiters[priority][user_id]
+            self._dequeued(state, user_id)
+            return waiter
+        return None
+
+    def _remove_waiter(self, state, priority, waiter):
+        user_waiters = state.waiters[priority].get(waiter.user_id)
+        if user_waiters is None or waiter not in user_waiters:
+            return
+        user_waiters.remove(waiter)
+        if not user_waiters:
+            del state.waiters[priority][waiter.user_id]
+            state.rotation[priority].remove(waiter.user_id)
+        self._dequeued(state, waiter.user_id)
+
+    def _dequeued(self, state, user_id):
+        state.queued -= 1
+        remaining = state.queued_by_user[user_id] - 1
+        if remaining:
+            state.queued_by_user[user_id] = remaining
+        else:
+            del state.queued_by_user[user_id]
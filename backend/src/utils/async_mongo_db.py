@@ -0,0 +1,75 @@
+import os
+import datetime
+import logging
+from pymongo import AsyncMongoClient, DESCENDING
+from src.utils.mongo_db import DB_NAME, CONFIG_VERSION_KEY, client_options, _format_chat
+
+
+class AsyncMongoDB:
+    """The chat path's Mongo reads and writes on pymongo's asyncio client, for the ASGI server.
+
+    The client belongs to the event loop it is first used on. Everything else, including index bootstrap
+    and retrieval, stays on the synchronous MongoDB class.
+    """
+
+    def __init__(self, config_cache=None):
+        # Share the synchronous MongoDB's config cache so both paths see the same templates and invalidations
+        self.config_cache = config_cache
+        self._client = None
+
+    @property
+    def db(self):
+        if self._client is None:
+            self._client = AsyncMongoClient(os.getenv("MONGODB_URI"), **client_options())
+        return self._client[DB_NAME]
+
+    async def get_recent_turns(self, user_id, n):
+        if n <= 0:
+            return []
+        try:
+            cursor = self.db["chat_history"].find({"user_id": user_id}, {"user_id": 0}).sort(
+                [("created_at", DESCENDING), ("_id", DESCENDING)]
+            ).limit(n)
+            chats = await cursor.to_list(length=n)
+            return [_format_chat(chat) for chat in reversed(chats)]
+        except Exception as e:
+            logging.error(f"Error getting recent turns: {str(e)}")
+            return []
+
+    async def get_user_prompt_template(self, user_id):
+        try:
+            if self.config_cache is None:
+                return await self._load_user_prompt_template(user_id)
+            if self.config_cache.version_check_due():
+                doc = await self.db["versions"].find_one({"_id": CONFIG_VERSION_KEY})
+                self.config_cache.apply_version(doc["version"] if doc else 0)
+            key = ("prompt_template", user_id)
+            template = self.config_cache.lookup(key)
+            if template is None:
+                template = await self._load_user_prompt_template(user_id)
+                self.config_cache.put(key, template)
+            return template
+        except Exception as e:
+            logging.error(f"Error getting prompt template: {str(e)}")
+            return ""
+
+    async def _load_user_prompt_template(self, user_id):
+        doc = await self.db["prompts"].find_one({"user_id": user_id})
+        return doc["prompt_template"] if doc and "prompt_template" in doc else ""
+
+    async def save_chat(self, user_id, message, response):
+        # Awaited rather than queued: the insert holds no thread while in flight
+        try:
+            await self.db["chat_history"].insert_one({
+                "user_id": user_id,
+                "message": message,
+                "response": response,
+                "created_at": datetime.datetime.utcnow()
+            })
+        except Exception as e:
+            logging.error(f"Error saving chat: {str(e)}")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
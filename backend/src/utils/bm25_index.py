@@ -0,0 +1,50 @@
+import os
+import re
+import math
+from collections import Counter, defaultdict
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Very common words carry no ranking signal and have the longest postings lists
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i if in into is it its me my no not of on or
+our she so than that the their them then there these they this to was we were what when where which
+who why will with would you your do does did can could should about how
+""".split())
+
+def tokenize(text):
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+def build_postings(user_id, chunk_id, text):
+    tokens = tokenize(text)
+    postings = [
+        {"user_id": user_id, "term": term, "chunk_id": chunk_id, "tf": tf, "length": len(tokens)}
+        for term, tf in Counter(tokens).items()
+    ]
+    return len(tokens), postings
+
+def score(postings, doc_count, avg_length, k1=BM25_K1, b=BM25_B):
+    by_term = defaultdict(list)
+    for posting in postings:
+        by_term[posting["term"]].append(posting)
+    scores = defaultdict(float)
+    avg_length = avg_length or 1.0
+    for term_postings in by_term.values():
+        df = len(term_postings)
+        idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+        for posting in term_postings:
+            tf = posting["tf"]
+            norm = k1 * (1 - b + b * posting["length"] / avg_length)
+            scores[posting["chunk_id"]] += idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            fused[chunk_id] += 1.0 / (k + rank + 1)
+    return fused
@@ -0,0 +1,87 @@
+import os
+import time
+import logging
+import threading
+
+CONFIG_CACHE_TTL_SECONDS = float(os.getenv("CONFIG_CACHE_TTL_SECONDS", "300"))
+CONFIG_VERSION_POLL_SECONDS = float(os.getenv("CONFIG_VERSION_POLL_SECONDS", "2"))
+
+
+class ConfigCache:
+    """Read-through cache for rarely changing configuration.
+
+    Entries expire after `ttl` seconds. When a `version_reader` is given, it is polled at most every
+    `poll_interval` seconds and any change (a write in another process) drops every cached entry.
+    """
+
+    def __init__(self, version_reader=None, ttl=CONFIG_CACHE_TTL_SECONDS, poll_interval=CONFIG_VERSION_POLL_SECONDS):
+        self.version_reader = version_reader
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._entries = {}
+        self._version = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        self._sync_version()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        value = loader()
+        self.put(key, value)
+        return value
+
+    def lookup(self, key, default=None):
+        # Unlike get, never loads or polls; for async callers that poll with version_check_due/apply_version
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+        return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def version_check_due(self):
+        # True at most once per poll interval; the caller then reads the version and passes it to apply_version
+        if self.version_reader is None:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at < self.poll_interval:
+                return False
+            self._checked_at = now
+            return True
+
+    def apply_version(self, version):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+
+    def _sync_version(self):
+        if not self.version_check_due():
+            return
+        try:
+            version = self.version_reader()
+        except Exception as e:
+            logging.error(f"Error reading config version: {str(e)}")
+            return
+        self.apply_version(version)
+
+    def note_version(self, version):
+        # Our own write bumped the version; keep our entries instead of clearing them on the next poll
+        with self._lock:
+            if self._version is not None and version == self._version + 1:
+                self._version = version
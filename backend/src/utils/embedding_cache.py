@@ -0,0 +1,149 @@
+import os
+import re
+import fcntl
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "50000"))
+# Set EMBEDDING_CACHE_DIR to an empty string to keep only the in-memory tier
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "/tmp/embedding_cache")
+
+_KEY_SIZE = 32
+
+def cache_key(text, model_id):
+    return hashlib.sha256(model_id.encode("utf-8") + b"\0" + text.encode("utf-8")).digest()
+
+
+class DiskEmbeddingStore:
+    """Append-only vector file shared by all processes, read through a memory map.
+
+    Row i of `<model>.f32` holds the vector whose sha256 key is stored at offset i * 32 of
+    `<model>.keys`. Vectors are written before their key, so any key a reader sees has a
+    complete vector behind it, and each writer first trims both files back to whole rows, so a
+    crashed append leaves nothing behind.
+    """
+
+    def __init__(self, directory, model_id, dim):
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, re.sub(r"[^A-Za-z0-9._-]", "_", model_id))
+        self.dim = dim
+        self.vectors_path = base + ".f32"
+        self.keys_path = base + ".keys"
+        self.lock_path = base + ".lock"
+        self._rows = {}
+        self._mmap = None
+        self._lock = threading.Lock()
+        for path in (self.vectors_path, self.keys_path):
+            open(path, "ab").close()
+
+    def get_many(self, keys):
+        with self._lock:
+            if any(key not in self._rows for key in keys):
+                self._refresh()
+            rows = {key: self._rows[key] for key in keys if key in self._rows}
+            if not rows:
+                return {}
+            self._ensure_mapped(max(rows.values()) + 1)
+            return {key: np.array(self._mmap[row]) for key, row in rows.items()}
+
+    def put_many(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, open(self.lock_path, "ab") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                new = [i for i, key in enumerate(keys) if key not in self._rows]
+                if not new:
+                    return
+                start = len(self._rows)
+                # Truncate any partial row or key left behind by a writer that crashed mid-append
+                with open(self.vectors_path, "r+b") as f:
+                    f.truncate(start * self.dim * 4)
+                    f.seek(0, os.SEEK_END)
+                    f.write(vectors[new].tobytes())
+                with open(self.keys_path, "r+b") as f:
+                    f.truncate(start * _KEY_SIZE)
+                    f.seek(0, os.SEEK_END)
+                    f.write(b"".join(keys[i] for i in new))
+                for offset, i in enumerate(new):
+                    self._rows[keys[i]] = start + offset
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        # Pick up rows appended by other processes since the last read
+        with open(self.keys_path, "rb") as f:
+            f.seek(len(self._rows) * _KEY_SIZE)
+            data = f.read()
+        count = len(data) // _KEY_SIZE
+        start = len(self._rows)
+        for i in range(count):
+            self._rows[data[i * _KEY_SIZE:(i + 1) * _KEY_SIZE]] = start + i
+
+    def _ensure_mapped(self, rows):
+        if self._mmap is None or self._mmap.shape[0] < rows:
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self._rows), self.dim))
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: a bounded in-memory LRU in front of a DiskEmbeddingStore."""
+
+    def __init__(self, model_id, dim, capacity=EMBEDDING_CACHE_SIZE, directory=EMBEDDING_CACHE_DIR):
+        self.model_id = model_id
+        self.dim = dim
+        self.capacity = capacity
+        self.disk = DiskEmbeddingStore(directory, model_id, dim) if directory else None
+        self.hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode(self, texts, encoder):
+        texts = list(texts)
+        keys = [cache_key(text, self.model_id) for text in texts]
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    found[key] = self._lru[key]
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing and self.disk is not None:
+            try:
+                from_disk = self.disk.get_many(missing)
+            except Exception as e:
+                logging.error(f"Error reading embedding cache: {str(e)}")
+                from_disk = {}
+            found.update(from_disk)
+            self._remember(from_disk)
+            missing = [key for key in missing if key not in found]
+        if missing:
+            # Encode each distinct missing text once, even if it repeats within the batch
+            text_by_key = dict(zip(keys, texts))
+            vectors = encoder([text_by_key[key] for key in missing])
+            computed = dict(zip(missing, vectors))
+            found.update(computed)
+            self._remember(computed)
+            if self.disk is not None:
+                try:
+                    self.disk.put_many(missing, vectors)
+                except Exception as e:
+                    logging.error(f"Error writing embedding cache: {str(e)}")
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+        result = np.empty((len(keys), self.dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            result[i] = found[key]
+        return result
+
+    def _remember(self, entries):
+        with self._lock:
+            for key, vector in entries.items():
+                self._lru[key] = vector
+                self._lru.move_to_end(key)
+            while len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
@@ -0,0 +1,68 @@
+import os
+import logging
+import threading
+import numpy as np
+from bson.binary import Binary
+from dotenv import load_dotenv
+from src.utils.embedding_cache import EmbeddingCache
+
+load_dotenv()
+
+# all-mpnet-base-v2 produces 768-dim vectors, matching the existing chunk schema
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-mpnet-base-v2")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "768"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# Embeddings are stored as packed bytes; float16 is ample for unit-length vectors
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float16")
+
+_model = None
+_model_lock = threading.Lock()
+_cache = None
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+                logging.info(f"Loaded embedding model {EMBEDDING_MODEL}")
+    return _model
+
+def encode(texts, batch_size=EMBEDDING_BATCH_SIZE):
+    texts = list(texts)
+    if not texts:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    vectors = get_model().encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False
+    )
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _model_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(EMBEDDING_MODEL, EMBEDDING_DIM)
+    return _cache
+
+def encode_cached(texts, batch_size=EMBEDDING_BATCH_SIZE):
+    # Identical chunk text under the same model is only ever encoded once
+    return get_cache().encode(texts, lambda missing: encode(missing, batch_size=batch_size))
+
+def encode_query(query):
+    return encode([query])[0]
+
+def pack_embedding(vector, dtype=EMBEDDING_STORAGE_DTYPE):
+    return Binary(np.asarray(vector, dtype=dtype).tobytes())
+
+def unpack_embedding(value, dtype="float32"):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        # Zero-copy view over the BSON payload
+        return np.frombuffer(value, dtype=dtype)
+    # Chunks indexed before binary storage hold a plain list of doubles
+    return np.asarray(value, dtype=np.float32)
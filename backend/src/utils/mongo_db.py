@@ -1,35 +1,224 @@
 
 import os
-from pymongo import MongoClient, ASCENDING, DESCENDING
+import sys
+import uuid
+import time
+import heapq
+import datetime
+import threading
+from operator import itemgetter
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from bson.errors import InvalidId
 from dotenv import load_dotenv
 import logging
+from src.utils import embeddings, bm25_index
+from src.utils.vector_index import VectorIndexRegistry, CorpusState
+from src.utils.response_cache import LLM_CACHE_TTL_SECONDS
+from src.utils.config_cache import ConfigCache
+from src.utils.write_behind import WriteBehindBuffer
+from src.utils.retrieval_cache import RetrievalCache, normalize_query
+
+load_dotenv()
+
+DB_NAME = "rag_db"
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+# Disable for a local mongod without TLS, e.g. when running the benchmarks
+MONGODB_TLS = os.getenv("MONGODB_TLS", "true").lower() in ("1", "true", "yes")
+# Check the index marker on first use; disable once `python -m src.utils.mongo_db ensure-indexes` runs at deploy time
+MONGODB_AUTO_INDEX = os.getenv("MONGODB_AUTO_INDEX", "true").lower() in ("1", "true", "yes")
+# After a failed check, requests skip it for this long instead of each retrying under the index lock
+INDEX_CHECK_RETRY_SECONDS = 30
+# Bump whenever ensure_indexes changes so existing deployments pick up the new indexes
+INDEX_VERSION = 4
+INDEX_MARKER_ID = "schema:indexes"
+CONFIG_VERSION_KEY = "config"
+# Collections rebuilt by the re-indexer, which writes them under REINDEX_SUFFIX and renames them into place
+REINDEXED_COLLECTIONS = ("document_chunks", "term_postings", "bm25_stats")
+REINDEX_SUFFIX = "_reindex"
+# Queue chat records and insert them in batches off the request path
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "true").lower() in ("1", "true", "yes")
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")  # "vector", "keyword" or "hybrid"
+
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+# Chunked upload sessions are forgotten this long after their last part
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+# A chunk write still pending after this long is assumed to have died and no longer holds back readers
+CHUNK_WRITE_TIMEOUT_SECONDS = 600
+
+# Readers that only need chunk text never pull embeddings over the wire
+TEXT_ONLY_PROJECTION = {"_id": 0, "embedding": 0, "embedding_dtype": 0}
+
+def corpus_version_key(user_id):
+    return f"corpus:{user_id}"
+
+def encode_chat_cursor(chat):
+    created_at = chat.get("created_at")
+    return f"{created_at.isoformat() if created_at else ''}_{chat['_id']}"
+
+def decode_chat_cursor(cursor):
+    # Raises ValueError for anything encode_chat_cursor could not have produced
+    created_at, _, oid = cursor.rpartition("_")
+    try:
+        oid = ObjectId(oid)
+    except InvalidId:
+        raise ValueError(f"Invalid chat cursor: {cursor}")
+    return (datetime.datetime.fromisoformat(created_at) if created_at else None), oid
+
+def _format_chat(chat):
+    created_at = chat.get("created_at")
+    return {
+        "message": chat.get("message"),
+        "response": chat.get("response"),
+        "created_at": created_at.isoformat() if created_at else None
+    }
+
+def _chat_sort_key(chat):
+    # Newest first when reversed, with chats lacking created_at after all timestamped ones
+    created_at = chat.get("created_at")
+    return created_at is not None, created_at or datetime.datetime.min, chat["_id"]
+
+def _is_before(chat, created_at, oid):
+    # Whether chat sorts after the (created_at, oid) cursor, matching get_chat_history_page's query
+    if created_at is None:
+        return chat.get("created_at") is None and chat["_id"] < oid
+    return _chat_sort_key(chat) < (True, created_at, oid)
+
+def _chunk_vector(chunk):
+    return embeddings.unpack_embedding(chunk["embedding"], chunk.get("embedding_dtype", "float32"))
+
+_client = None
+_client_lock = threading.Lock()
+_index_lock = threading.Lock()
+_indexes_checked = False
+_index_retry_at = 0.0
+_shared_db = None
+
+def client_options():
+    # Shared with the async client; pymongo rejects TLS-only options when TLS is off
+    options = {"tls": MONGODB_TLS, "maxPoolSize": MONGODB_MAX_POOL_SIZE, "minPoolSize": MONGODB_MIN_POOL_SIZE}
+    if MONGODB_TLS:
+        options["tlsAllowInvalidCertificates"] = True
+    return options
+
+def get_client():
+    # One client (and connection pool) per process, created on first use
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(os.getenv("MONGODB_URI"), connect=False, **client_options())
+    return _client
+
+def _reset_after_fork():
+    # Sockets inherited across fork are unusable; forked workers build their own pool lazily
+    global _client, _client_lock, _index_lock, _indexes_checked, _index_retry_at
+    _client = None
+    _client_lock = threading.Lock()
+    _index_lock = threading.Lock()
+    _indexes_checked = False
+    _index_retry_at = 0.0
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_mongo_db():
+    global _shared_db
+    if _shared_db is None:
+        with _client_lock:
+            if _shared_db is None:
+                _shared_db = MongoDB()
+    return _shared_db
+
+def _collection(name):
+    return property(lambda self: self.db[name])
 
 class MongoDB():
+    models_col = _collection("models")
+    user_models_col = _collection("user_models")
+    documents_col = _collection("documents")
+    chunks_col = _collection("document_chunks")
+    prompts_col = _collection("prompts")
+    chat_col = _collection("chat_history")
+    postings_col = _collection("term_postings")
+    bm25_stats_col = _collection("bm25_stats")
+    versions_col = _collection("versions")
+    jobs_col = _collection("ingestion_jobs")
+    llm_cache_col = _collection("llm_response_cache")
+    reindex_runs_col = _collection("reindex_runs")
+    reindex_checkpoints_col = _collection("reindex_checkpoints")
+    uploads_col = _collection("upload_sessions")
 
     def __init__(self):
-        load_dotenv()
-        db_uri = os.getenv("MONGODB_URI")
-        db_name = "rag_db"
-        self.client = MongoClient(db_uri, tls=True, tlsAllowInvalidCertificates=True)
-        self.db = self.client[db_name]
-        self.models_col = self.db["models"]
-        self.user_models_col = self.db["user_models"]
-        self.documents_col = self.db["documents"]
-        self.chunks_col = self.db["document_chunks"]
-        self.prompts_col = self.db["prompts"]
-        self.chat_col = self.db["chat_history"]
-
-        # Ensure indexes for efficient queries
-        self.user_models_col.create_index([("user_id", ASCENDING)], unique=True)
-        self.chunks_col.create_index([("user_id", ASCENDING)])
-        self.prompts_col.create_index([("user_id", ASCENDING)], unique=True)
-        self.chat_col.create_index([("user_id", ASCENDING)])
+        # Nothing touches the network here; the shared client connects on first query
+        self.vector_indexes = VectorIndexRegistry(self._load_user_vectors, embeddings.EMBEDDING_DIM)
+        # Model catalog, model selection and prompt templates; writes bump the shared config version
+        self.config_cache = ConfigCache(lambda: self.get_version(CONFIG_VERSION_KEY))
+        # Search results per (user, query, top_k, mode), valid while the user's corpus version is unchanged
+        self.retrieval_cache = RetrievalCache()
+        self.chat_writer = WriteBehindBuffer(lambda: self.chat_col, "chat_history") if CHAT_WRITE_BEHIND else None
+
+    @property
+    def client(self):
+        return get_client()
+
+    @property
+    def db(self):
+        db = self.client[DB_NAME]
+        if MONGODB_AUTO_INDEX and not _indexes_checked and time.monotonic() >= _index_retry_at:
+            self._check_indexes(db)
+        return db
+
+    # ----------------- Index Bootstrap -----------------
+    def ensure_indexes(self):
+        db = self.client[DB_NAME]
+        db["user_models"].create_index([("user_id", ASCENDING)], unique=True)
+        self._ensure_corpus_indexes(db)
+        db["reindex_checkpoints"].create_index(
+            [("run_id", ASCENDING), ("user_id", ASCENDING), ("file_path", ASCENDING)], unique=True
+        )
+        db["documents"].create_index([("user_id", ASCENDING), ("content_hash", ASCENDING)])
+        db["upload_sessions"].create_index([("updated_at", ASCENDING)], expireAfterSeconds=UPLOAD_SESSION_TTL_SECONDS)
+        db["prompts"].create_index([("user_id", ASCENDING)], unique=True)
+        db["chat_history"].create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+        db["ingestion_jobs"].create_index([("user_id", ASCENDING)])
+        db["llm_response_cache"].create_index([("created_at", ASCENDING)], expireAfterSeconds=LLM_CACHE_TTL_SECONDS)
+        db["versions"].update_one({"_id": INDEX_MARKER_ID}, {"$set": {"version": INDEX_VERSION}}, upsert=True)
+        logging.info(f"Ensured MongoDB indexes (version {INDEX_VERSION})")
+
+    def _ensure_corpus_indexes(self, db, suffix=""):
+        # Shared with the re-indexer's shadow collections, which must carry the same indexes once renamed
+        db["document_chunks" + suffix].create_index([("user_id", ASCENDING)])
+        db["document_chunks" + suffix].create_index([("user_id", ASCENDING), ("chunk_id", ASCENDING)])
+        db["document_chunks" + suffix].create_index([("user_id", ASCENDING), ("file_path", ASCENDING)])
+        db["document_chunks" + suffix].create_index([("user_id", ASCENDING), ("corpus_version", ASCENDING)])
+        db["term_postings" + suffix].create_index([("user_id", ASCENDING), ("term", ASCENDING)])
+        db["bm25_stats" + suffix].create_index([("user_id", ASCENDING)], unique=True)
+
+    def _check_indexes(self, db):
+        global _indexes_checked, _index_retry_at
+        with _index_lock:
+            # Threads that queued behind a failed check don't repeat it
+            if _indexes_checked or time.monotonic() < _index_retry_at:
+                return
+            try:
+                # A single read per process; the create_index calls only run when the marker is behind
+                marker = db["versions"].find_one({"_id": INDEX_MARKER_ID})
+                if not marker or marker.get("version", 0) < INDEX_VERSION:
+                    self.ensure_indexes()
+                _indexes_checked = True
+            except Exception as e:
+                _index_retry_at = time.monotonic() + INDEX_CHECK_RETRY_SECONDS
+                logging.error(f"Error checking MongoDB indexes: {str(e)}")
 
     # ----------------- Model Management -----------------
     def get_available_models(self):
         try:
-            models = list(self.models_col.find({}, {"_id": 0}))
-            return models
+            models = self.config_cache.get("models", lambda: list(self.models_col.find({}, {"_id": 0})))
+            return list(models)
         except Exception as e:
             logging.error(f"Error fetching models: {str(e)}")
             return []
@@ -41,63 +230,474 @@ class MongoDB():
                 {"$set": {"model_id": model_id}},
                 upsert=True
             )
+            self._config_written(("user_model", user_id), model_id)
         except Exception as e:
             logging.error(f"Error setting user model: {str(e)}")
             raise
 
     def get_user_model(self, user_id):
         try:
-            doc = self.user_models_col.find_one({"user_id": user_id})
-            return doc["model_id"] if doc and "model_id" in doc else None
+            return self.config_cache.get(("user_model", user_id), lambda: self._load_user_model(user_id))
         except Exception as e:
             logging.error(f"Error getting user model: {str(e)}")
             return None
 
+    def _load_user_model(self, user_id):
+        doc = self.user_models_col.find_one({"user_id": user_id})
+        return doc["model_id"] if doc and "model_id" in doc else None
+
+    def _config_written(self, key, value):
+        # Write-through locally, then signal other processes to drop their cached config
+        self.config_cache.put(key, value)
+        self.config_cache.note_version(self.bump_version(CONFIG_VERSION_KEY))
+
     # ----------------- Document Storage -----------------
-    def store_document_metadata(self, user_id, file_path, filename):
+    def store_document_metadata(self, user_id, file_path, filename, content_hash=None):
         try:
             doc = {
                 "user_id": user_id,
                 "file_path": file_path,
-                "filename": filename
+                "filename": filename,
+                "content_hash": content_hash,
+                "status": "queued"
             }
             self.documents_col.insert_one(doc)
+            self.bump_version(corpus_version_key(user_id))
         except Exception as e:
             logging.error(f"Error storing document metadata: {str(e)}")
 
+    def set_document_status(self, user_id, file_path, status):
+        # "indexed" once the ingestion job succeeds, "failed" otherwise
+        try:
+            self.documents_col.update_many({"user_id": user_id, "file_path": file_path}, {"$set": {"status": status}})
+        except Exception as e:
+            logging.error(f"Error updating document status: {str(e)}")
+
+    def find_document_by_hash(self, user_id, content_hash):
+        # Only fully indexed documents count, so a file whose ingestion failed can be uploaded again
+        try:
+            return self.documents_col.find_one(
+                {"user_id": user_id, "content_hash": content_hash, "status": "indexed"}, {"_id": 0}
+            )
+        except Exception as e:
+            logging.error(f"Error looking up document by hash: {str(e)}")
+            return None
+
     def index_document_chunk(self, doc_chunk):
         try:
-            self.chunks_col.insert_one(doc_chunk)
+            self.index_document_chunks([doc_chunk])
         except Exception as e:
             logging.error(f"Error indexing document chunk: {str(e)}")
 
-    def get_document_chunks(self, user_id):
+    def index_document_chunks(self, doc_chunks):
+        by_user = {}
+        for chunk in doc_chunks:
+            by_user.setdefault(chunk["user_id"], []).append(chunk)
+        for user_id, chunks in by_user.items():
+            # Stamped with a reserved version so readers can load just the rows written since they last looked
+            version = self._reserve_corpus_version(user_id)
+            for chunk in chunks:
+                chunk["corpus_version"] = version
+            try:
+                # One unordered round trip per batch instead of one insert_one per chunk
+                self.chunks_col.insert_many(chunks, ordered=False)
+            except Exception as e:
+                logging.error(f"Error indexing document chunks: {str(e)}")
+                raise
+            finally:
+                self._publish_corpus_version(user_id, version)
+
+    def get_document_chunks(self, user_id, include_embeddings=False):
+        projection = {"_id": 0} if include_embeddings else TEXT_ONLY_PROJECTION
         try:
-            return list(self.chunks_col.find({"user_id": user_id}, {"_id": 0}))
+            return list(self.chunks_col.find({"user_id": user_id}, projection))
         except Exception as e:
             logging.error(f"Error getting document chunks: {str(e)}")
             return []
 
-    def retrieve_documents(self, user_id, query, top_k=5):
+    def _load_user_vectors(self, user_id, after=None):
+        query = {"user_id": user_id}
+        if after is not None:
+            query["corpus_version"] = {"$gt": after}
+        cursor = self.chunks_col.find(
+            query, {"chunk_id": 1, "text": 1, "embedding": 1, "embedding_dtype": 1, "corpus_version": 1}
+        )
+        for chunk in cursor:
+            yield chunk["_id"], chunk.get("corpus_version", 0), chunk["chunk_id"], chunk["text"], _chunk_vector(chunk)
+
+    def index_chunk_terms(self, user_id, doc_chunks):
         try:
-            # Simple keyword search; can be replaced with semantic search
-            chunks = self.get_document_chunks(user_id)
-            scored = []
-            for chunk in chunks:
-                score = chunk['text'].lower().count(query.lower())
-                if score > 0:
-                    scored.append((score, chunk['text']))
-            scored.sort(reverse=True, key=lambda x: x[0])
-            return [text for _, text in scored[:top_k]]
+            postings = []
+            total_length = 0
+            for chunk in doc_chunks:
+                length, chunk_postings = bm25_index.build_postings(user_id, chunk["chunk_id"], chunk["text"])
+                total_length += length
+                postings.extend(chunk_postings)
+            if postings:
+                self.postings_col.insert_many(postings, ordered=False)
+            self.bm25_stats_col.update_one(
+                {"user_id": user_id},
+                {"$inc": {"doc_count": len(doc_chunks), "total_length": total_length}},
+                upsert=True
+            )
+        except Exception as e:
+            logging.error(f"Error indexing chunk terms: {str(e)}")
+
+    def remove_document_chunks(self, user_id, file_path):
+        # Undoes whatever a failed ingestion already indexed for this file
+        try:
+            chunk_ids = []
+            total_length = 0
+            for chunk in self.chunks_col.find({"user_id": user_id, "file_path": file_path}, TEXT_ONLY_PROJECTION):
+                length, _ = bm25_index.build_postings(user_id, chunk["chunk_id"], chunk["text"])
+                chunk_ids.append(chunk["chunk_id"])
+                total_length += length
+            if not chunk_ids:
+                return 0
+            self.postings_col.delete_many({"user_id": user_id, "chunk_id": {"$in": chunk_ids}})
+            self.chunks_col.delete_many({"user_id": user_id, "file_path": file_path})
+            self.bm25_stats_col.update_one(
+                {"user_id": user_id},
+                {"$inc": {"doc_count": -len(chunk_ids), "total_length": -total_length}}
+            )
+            # Rows were removed, not added, so every process reloads this user rather than catching up
+            self.versions_col.update_one(
+                {"_id": corpus_version_key(user_id)},
+                {"$inc": {"version": 1}, "$set": {"reset": uuid.uuid4().hex}},
+                upsert=True
+            )
+            self.vector_indexes.invalidate(user_id)
+            return len(chunk_ids)
+        except Exception as e:
+            logging.error(f"Error removing document chunks: {str(e)}")
+            return 0
+
+    def vector_search(self, user_id, query, top_k=5):
+        return self.vector_search_many(user_id, [query], top_k)[0]
+
+    def vector_search_many(self, user_id, queries, top_k=5):
+        index = self.vector_indexes.get(user_id, self.get_corpus_state(user_id))
+        if len(index) == 0:
+            return [[] for _ in queries]
+        # One encoder call and one matrix product for every query in the batch
+        results = index.search_many(embeddings.encode(queries), top_k)
+        # Placeholder (all-zero) embeddings score 0 and never count as a match
+        return [[(score, chunk_id, text) for score, chunk_id, text in hits if score > 0] for hits in results]
+
+    def keyword_search(self, user_id, query, top_k=5):
+        return self.keyword_search_many(user_id, [query], top_k)[0]
+
+    def keyword_search_many(self, user_id, queries, top_k=5):
+        query_terms = [set(bm25_index.tokenize(query)) for query in queries]
+        all_terms = sorted(set().union(*query_terms))
+        if not all_terms:
+            return [[] for _ in queries]
+        stats = self.bm25_stats_col.find_one({"user_id": user_id})
+        if not stats or not stats.get("doc_count"):
+            return [[] for _ in queries]
+        # Only the postings of the query terms are read, never the whole corpus
+        postings_by_term = {}
+        for posting in self.postings_col.find(
+            {"user_id": user_id, "term": {"$in": all_terms}},
+            {"_id": 0, "term": 1, "chunk_id": 1, "tf": 1, "length": 1}
+        ):
+            postings_by_term.setdefault(posting["term"], []).append(posting)
+        avg_length = stats["total_length"] / stats["doc_count"]
+        tops = []
+        for terms in query_terms:
+            postings = [posting for term in terms for posting in postings_by_term.get(term, [])]
+            scores = bm25_index.score(postings, stats["doc_count"], avg_length)
+            tops.append(heapq.nlargest(top_k, scores.items(), key=itemgetter(1)))
+        texts = self._get_chunk_texts(user_id, list({chunk_id for top in tops for chunk_id, _ in top}))
+        return [[(score, chunk_id, texts[chunk_id]) for chunk_id, score in top if chunk_id in texts] for top in tops]
+
+    def hybrid_search(self, user_id, query, top_k=5):
+        return self.hybrid_search_many(user_id, [query], top_k)[0]
+
+    def hybrid_search_many(self, user_id, queries, top_k=5):
+        candidates = top_k * 4
+        results = []
+        for vector_hits, keyword_hits in zip(
+            self.vector_search_many(user_id, queries, candidates),
+            self.keyword_search_many(user_id, queries, candidates)
+        ):
+            texts = {chunk_id: text for _, chunk_id, text in vector_hits + keyword_hits}
+            fused = bm25_index.reciprocal_rank_fusion([
+                [chunk_id for _, chunk_id, _ in vector_hits],
+                [chunk_id for _, chunk_id, _ in keyword_hits]
+            ])
+            top = heapq.nlargest(top_k, fused.items(), key=itemgetter(1))
+            results.append([(score, chunk_id, texts[chunk_id]) for chunk_id, score in top])
+        return results
+
+    def search_chunks(self, user_id, query, top_k=5, mode=None):
+        return self.search_chunks_many(user_id, [query], top_k, mode)[0]
+
+    def search_chunks_many(self, user_id, queries, top_k=5, mode=None):
+        mode = mode or RETRIEVAL_MODE
+        # Misses are searched with the normalized text too, so a hit returns exactly what a miss would
+        queries = [normalize_query(query) for query in queries]
+        version = self.get_version(corpus_version_key(user_id))
+        results = [self.retrieval_cache.get(user_id, query, top_k, mode, version) for query in queries]
+        missing = [i for i, hits in enumerate(results) if hits is None]
+        if missing:
+            searched = self._search_chunks_uncached(user_id, [queries[i] for i in missing], top_k, mode)
+            for i, hits in zip(missing, searched):
+                self.retrieval_cache.put(user_id, queries[i], top_k, mode, version, hits)
+                results[i] = hits
+        return results
+
+    def _search_chunks_uncached(self, user_id, queries, top_k, mode):
+        if mode == "vector":
+            return self.vector_search_many(user_id, queries, top_k)
+        if mode == "keyword":
+            return self.keyword_search_many(user_id, queries, top_k)
+        return self.hybrid_search_many(user_id, queries, top_k)
+
+    def retrieve_documents(self, user_id, query, top_k=5, mode=None):
+        try:
+            return [text for _, _, text in self.search_chunks(user_id, query, top_k, mode)]
         except Exception as e:
             logging.error(f"Error retrieving documents: {str(e)}")
             return []
 
+    def retrieve_documents_many(self, user_id, queries, top_k=5, mode=None):
+        # Unlike retrieve_documents, errors propagate so batch callers can report them
+        return [[text for _, _, text in hits] for hits in self.search_chunks_many(user_id, queries, top_k, mode)]
+
+    def _get_chunk_texts(self, user_id, chunk_ids):
+        if not chunk_ids:
+            return {}
+        cursor = self.chunks_col.find(
+            {"user_id": user_id, "chunk_id": {"$in": chunk_ids}},
+            {"_id": 0, "chunk_id": 1, "text": 1}
+        )
+        return {chunk["chunk_id"]: chunk["text"] for chunk in cursor}
+
     def process_and_index_document(self, user_id, file_path, filename):
         # This should be called from the document service after file is saved and processed
         self.store_document_metadata(user_id, file_path, filename)
         # Actual chunking and indexing is handled in the document service
 
+    # ----------------- Versions -----------------
+    def bump_version(self, key):
+        doc = self.versions_col.find_one_and_update(
+            {"_id": key},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return doc["version"]
+
+    def get_version(self, key):
+        doc = self.versions_col.find_one({"_id": key})
+        return doc["version"] if doc else 0
+
+    def get_corpus_state(self, user_id):
+        doc = self.versions_col.find_one({"_id": corpus_version_key(user_id)}) or {}
+        version = doc.get("version", 0)
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=CHUNK_WRITE_TIMEOUT_SECONDS)
+        pending = [int(v) for v, started in doc.get("pending", {}).items() if started > cutoff]
+        # Rows stamped below the oldest write still in flight are all visible
+        watermark = min(pending) - 1 if pending else version
+        return CorpusState(version, watermark, doc.get("reset"))
+
+    def _reserve_corpus_version(self, user_id):
+        # Bumps the version and marks it pending in one update, so no reader can see it without the mark
+        key = corpus_version_key(user_id)
+        while True:
+            doc = self.versions_col.find_one({"_id": key})
+            current = doc["version"] if doc else 0
+            version = current + 1
+            try:
+                result = self.versions_col.update_one(
+                    {"_id": key, "version": current},
+                    {"$set": {"version": version, f"pending.{version}": datetime.datetime.utcnow()}},
+                    upsert=doc is None
+                )
+            except DuplicateKeyError:
+                continue
+            if doc is None or result.matched_count == 1:
+                return version
+
+    def _publish_corpus_version(self, user_id, version):
+        return self.versions_col.find_one_and_update(
+            {"_id": corpus_version_key(user_id)},
+            {"$inc": {"version": 1}, "$unset": {f"pending.{version}": ""}},
+            return_document=ReturnDocument.AFTER
+        )["version"]
+
+    # ----------------- Re-indexing -----------------
+    def _shadow(self, name):
+        return self.db[name + REINDEX_SUFFIX]
+
+    def list_documents(self):
+        # One entry per stored file; metadata can be written more than once for the same upload
+        documents = {}
+        for doc in self.documents_col.find({}, {"_id": 0, "user_id": 1, "file_path": 1, "filename": 1}):
+            documents.setdefault((doc["user_id"], doc["file_path"]), doc)
+        return list(documents.values())
+
+    def start_reindex_run(self, settings):
+        run_id = uuid.uuid4().hex
+        for name in REINDEXED_COLLECTIONS:
+            self._shadow(name).drop()
+        self._ensure_corpus_indexes(self.db, REINDEX_SUFFIX)
+        self.reindex_runs_col.update_many({"status": "running"}, {"$set": {"status": "abandoned"}})
+        self.reindex_runs_col.insert_one({
+            "_id": run_id,
+            "status": "running",
+            "settings": settings,
+            "created_at": datetime.datetime.utcnow()
+        })
+        return run_id
+
+    def get_open_reindex_run(self):
+        return self.reindex_runs_col.find_one({"status": "running"}, sort=[("created_at", DESCENDING)])
+
+    def get_reindex_checkpoints(self, run_id):
+        return list(self.reindex_checkpoints_col.find({"run_id": run_id}, {"_id": 0}))
+
+    def record_reindex_checkpoint(self, run_id, user_id, file_path, status, chunks=0, total_length=0, error=None):
+        self.reindex_checkpoints_col.update_one(
+            {"run_id": run_id, "user_id": user_id, "file_path": file_path},
+            {"$set": {
+                "status": status,
+                "chunks": chunks,
+                "total_length": total_length,
+                "error": error,
+                "updated_at": datetime.datetime.utcnow()
+            }},
+            upsert=True
+        )
+
+    def clear_shadow_document(self, user_id, file_path):
+        # Drops whatever an interrupted attempt already wrote for this file
+        chunks = self._shadow("document_chunks")
+        chunk_ids = [
+            chunk["chunk_id"]
+            for chunk in chunks.find({"user_id": user_id, "file_path": file_path}, {"_id": 0, "chunk_id": 1})
+        ]
+        if chunk_ids:
+            self._shadow("term_postings").delete_many({"user_id": user_id, "chunk_id": {"$in": chunk_ids}})
+            chunks.delete_many({"user_id": user_id, "file_path": file_path})
+
+    def write_shadow_chunks(self, doc_chunks, postings):
+        self._shadow("document_chunks").insert_many(doc_chunks, ordered=False)
+        if postings:
+            self._shadow("term_postings").insert_many(postings, ordered=False)
+
+    def switch_to_reindexed(self, run_id, allow_failed=False):
+        # Returns None without switching if a document stored since the last pass has no checkpoint yet
+        checkpoints = self.get_reindex_checkpoints(run_id)
+        statuses = {(checkpoint["user_id"], checkpoint["file_path"]): checkpoint["status"] for checkpoint in checkpoints}
+        for document in self.list_documents():
+            status = statuses.get((document["user_id"], document["file_path"]))
+            if status is None or (status != "done" and not allow_failed):
+                return None
+        stats = {}
+        for checkpoint in checkpoints:
+            if checkpoint["status"] != "done":
+                continue
+            user_stats = stats.setdefault(
+                checkpoint["user_id"], {"user_id": checkpoint["user_id"], "doc_count": 0, "total_length": 0}
+            )
+            user_stats["doc_count"] += checkpoint["chunks"]
+            user_stats["total_length"] += checkpoint["total_length"]
+        shadow_stats = self._shadow("bm25_stats")
+        shadow_stats.delete_many({})
+        if stats:
+            shadow_stats.insert_many(list(stats.values()))
+        # Users who lose every chunk in the rebuild need their cached indexes dropped as well
+        user_ids = set(self.chunks_col.distinct("user_id")) | set(stats)
+        for name in REINDEXED_COLLECTIONS:
+            # Each rename replaces its target atomically, so readers never see a missing collection
+            self._shadow(name).rename(name, dropTarget=True)
+        for user_id in user_ids:
+            # Every process reloads these users from scratch rather than catching up
+            self.versions_col.update_one(
+                {"_id": corpus_version_key(user_id)},
+                {"$inc": {"version": 1}, "$set": {"reset": uuid.uuid4().hex}, "$unset": {"pending": ""}},
+                upsert=True
+            )
+            self.vector_indexes.invalidate(user_id)
+        self.reindex_runs_col.update_one(
+            {"_id": run_id},
+            {"$set": {"status": "completed", "completed_at": datetime.datetime.utcnow()}}
+        )
+        return len(user_ids)
+
+    # ----------------- Upload Sessions -----------------
+    def create_upload_session(self, session):
+        now = datetime.datetime.utcnow()
+        session.update({"status": "open", "next_part": 0, "received_bytes": 0, "created_at": now, "updated_at": now})
+        self.uploads_col.insert_one(session)
+
+    def get_upload_session(self, upload_id, user_id):
+        return self.uploads_col.find_one({"_id": upload_id, "user_id": user_id})
+
+    def advance_upload_session(self, upload_id, part_number, size):
+        # Only succeeds if no other request recorded this part first
+        result = self.uploads_col.update_one(
+            {"_id": upload_id, "status": "open", "next_part": part_number},
+            {
+                "$inc": {"next_part": 1, "received_bytes": size},
+                "$set": {"updated_at": datetime.datetime.utcnow()}
+            }
+        )
+        return result.modified_count == 1
+
+    def update_upload_session(self, upload_id, **fields):
+        fields["updated_at"] = datetime.datetime.utcnow()
+        self.uploads_col.update_one({"_id": upload_id}, {"$set": fields})
+
+    def open_upload_ids(self, upload_ids):
+        # Sessions the TTL index has not expired yet and that can still receive parts
+        cursor = self.uploads_col.find({"_id": {"$in": list(upload_ids)}, "status": "open"}, {"_id": 1})
+        return {session["_id"] for session in cursor}
+
+    # ----------------- Ingestion Jobs -----------------
+    def create_ingestion_job(self, job_id, user_id, file_path, filename):
+        now = datetime.datetime.utcnow()
+        self.jobs_col.insert_one({
+            "_id": job_id,
+            "user_id": user_id,
+            "file_path": file_path,
+            "filename": filename,
+            "status": "queued",
+            "chunks_indexed": 0,
+            "total_chunks": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        })
+
+    def update_ingestion_job(self, job_id, **fields):
+        try:
+            fields["updated_at"] = datetime.datetime.utcnow()
+            self.jobs_col.update_one({"_id": job_id}, {"$set": fields})
+        except Exception as e:
+            logging.error(f"Error updating ingestion job {job_id}: {str(e)}")
+
+    def fail_stale_ingestion_job(self, job_id, cutoff, error):
+        # Only a job still running with no report since the cutoff; returns it if this call failed it
+        try:
+            return self.jobs_col.find_one_and_update(
+                {"_id": job_id, "status": "running", "updated_at": {"$lt": cutoff}},
+                {"$set": {"status": "failed", "error": error, "updated_at": datetime.datetime.utcnow()}},
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            logging.error(f"Error expiring ingestion job {job_id}: {str(e)}")
+            return None
+
+    def get_ingestion_job(self, job_id, user_id):
+        try:
+            return self.jobs_col.find_one({"_id": job_id, "user_id": user_id}, {"file_path": 0})
+        except Exception as e:
+            logging.error(f"Error getting ingestion job {job_id}: {str(e)}")
+            return None
+
     # ----------------- Prompt Templates -----------------
     def set_user_prompt_template(self, user_id, prompt_template):
         try:
@@ -106,45 +706,116 @@ class MongoDB():
                 {"$set": {"prompt_template": prompt_template}},
                 upsert=True
             )
+            self._config_written(("prompt_template", user_id), prompt_template)
         except Exception as e:
             logging.error(f"Error setting prompt template: {str(e)}")
             raise
 
     def get_user_prompt_template(self, user_id):
         try:
-            doc = self.prompts_col.find_one({"user_id": user_id})
-            return doc["prompt_template"] if doc and "prompt_template" in doc else ""
+            return self.config_cache.get(
+                ("prompt_template", user_id), lambda: self._load_user_prompt_template(user_id)
+            )
         except Exception as e:
             logging.error(f"Error getting prompt template: {str(e)}")
             return ""
 
+    def _load_user_prompt_template(self, user_id):
+        doc = self.prompts_col.find_one({"user_id": user_id})
+        return doc["prompt_template"] if doc and "prompt_template" in doc else ""
+
     def update_user_prompt(self, user_id, prompt_template):
         self.set_user_prompt_template(user_id, prompt_template)
 
     # ----------------- Chat History -----------------
     def save_chat(self, user_id, message, response):
         try:
-            self.chat_col.insert_one({
+            chat = {
                 "user_id": user_id,
                 "message": message,
-                "response": response
-            })
+                "response": response,
+                "created_at": datetime.datetime.utcnow()
+            }
+            if self.chat_writer is not None:
+                # Assigned up front so queued chats can be paged and deduplicated like stored ones
+                chat["_id"] = ObjectId()
+                self.chat_writer.put(chat)
+            else:
+                self.chat_col.insert_one(chat)
         except Exception as e:
             logging.error(f"Error saving chat: {str(e)}")
 
     def add_chat_message(self, user_id, message, response):
         self.save_chat(user_id, message, response)
 
-    def get_chat_history(self, user_id):
+    def get_chat_history_page(self, user_id, limit=CHAT_HISTORY_PAGE_SIZE, before=None):
+        # Keyset pagination, newest first, on (created_at, _id); chats saved before
+        # timestamps existed have no created_at and sort after all timestamped ones
+        query = {"user_id": user_id}
+        created_at = oid = None
+        if before:
+            created_at, oid = decode_chat_cursor(before)
+            if created_at is None:
+                query.update({"created_at": None, "_id": {"$lt": oid}})
+            else:
+                query["$or"] = [
+                    {"created_at": {"$lt": created_at}},
+                    {"created_at": created_at, "_id": {"$lt": oid}},
+                    {"created_at": None}
+                ]
+        cursor = self.chat_col.find(query, {"user_id": 0}).sort(
+            [("created_at", DESCENDING), ("_id", DESCENDING)]
+        ).limit(limit + 1)
+        chats = list(cursor)
+        if self.chat_writer is not None:
+            # Chats still in the write-behind queue belong on the page too, under the same cursor
+            seen = {chat["_id"] for chat in chats}
+            chats += [
+                chat for chat in self.chat_writer.pending(lambda chat: chat["user_id"] == user_id)
+                if chat["_id"] not in seen and (not before or _is_before(chat, created_at, oid))
+            ]
+            chats.sort(key=_chat_sort_key, reverse=True)
+        next_cursor = encode_chat_cursor(chats[limit - 1]) if len(chats) > limit else None
+        return [_format_chat(chat) for chat in chats[:limit]], next_cursor
+
+    def get_chat_history(self, user_id, limit=CHAT_HISTORY_PAGE_SIZE, before=None):
         try:
-            chats = list(self.chat_col.find({"user_id": user_id}, {"_id": 0, "user_id": 0}))
+            chats, _ = self.get_chat_history_page(user_id, limit, before)
             return chats
         except Exception as e:
             logging.error(f"Error getting chat history: {str(e)}")
             return []
 
+    def get_recent_turns(self, user_id, n):
+        # Last n turns, oldest first, ready to use as conversational context
+        if n <= 0:
+            return []
+        try:
+            chats = list(self.chat_col.find({"user_id": user_id}, {"user_id": 0}).sort(
+                [("created_at", DESCENDING), ("_id", DESCENDING)]
+            ).limit(n))
+            if self.chat_writer is not None:
+                # Include turns still waiting in the write-behind queue; skip any that landed meanwhile
+                seen = {chat["_id"] for chat in chats}
+                chats += [chat for chat in self.chat_writer.pending(lambda chat: chat["user_id"] == user_id)
+                          if chat.get("_id") not in seen]
+                chats.sort(key=lambda chat: chat.get("created_at") or datetime.datetime.min, reverse=True)
+            return [_format_chat(chat) for chat in reversed(chats[:n])]
+        except Exception as e:
+            logging.error(f"Error getting recent turns: {str(e)}")
+            return []
+
     def clear_chat_history(self, user_id):
         try:
+            if self.chat_writer is not None:
+                # Otherwise queued chats would be inserted after the delete
+                self.chat_writer.flush()
             self.chat_col.delete_many({"user_id": user_id})
         except Exception as e:
             logging.error(f"Error clearing chat history: {str(e)}")
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["ensure-indexes"]:
+        sys.exit("usage: python -m src.utils.mongo_db ensure-indexes")
+    logging.basicConfig(level=logging.INFO)
+    MongoDB().ensure_indexes()
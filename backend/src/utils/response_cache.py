@@ -0,0 +1,93 @@
+import os
+import time
+import hashlib
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+
+def prompt_key(model_id, prompt):
+    return f"{model_id}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}"
+
+
+class ResponseCache:
+    """LLM responses keyed by (model_id, prompt hash): a TTL+LRU in-process tier and an optional Mongo tier.
+
+    The shared collection is expected to carry a TTL index on `created_at`; entries are also age-checked
+    on read because Mongo only purges expired documents once a minute. It is looked up through
+    `shared_collection_getter` on each use, so building the cache never touches Mongo.
+    """
+
+    def __init__(self, ttl=LLM_CACHE_TTL_SECONDS, max_entries=LLM_CACHE_SIZE, shared_collection_getter=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared_collection_getter = shared_collection_getter
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model_id, prompt):
+        key = prompt_key(model_id, prompt)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, response = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self._entries[key]
+        response = self._get_shared(key)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+        self._put_local(key, response)
+        return response
+
+    def set(self, model_id, prompt, response):
+        key = prompt_key(model_id, prompt)
+        self._put_local(key, response)
+        if self.shared_collection_getter is not None:
+            try:
+                self.shared_collection_getter().replace_one(
+                    {"_id": key},
+                    {"response": response, "created_at": datetime.datetime.utcnow()},
+                    upsert=True
+                )
+            except Exception as e:
+                logging.error(f"Error writing shared LLM cache: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "size": len(self._entries)
+            }
+
+    def _put_local(self, key, response):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_shared(self, key):
+        if self.shared_collection_getter is None:
+            return None
+        try:
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.ttl)
+            doc = self.shared_collection_getter().find_one({"_id": key, "created_at": {"$gt": cutoff}})
+            return doc["response"] if doc else None
+        except Exception as e:
+            logging.error(f"Error reading shared LLM cache: {str(e)}")
+            return None
@@ -0,0 +1,78 @@
+import os
+import sys
+import unicodedata
+import threading
+from collections import OrderedDict
+
+RETRIEVAL_CACHE_MAX_BYTES = int(os.getenv("RETRIEVAL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+ENTRY_OVERHEAD_BYTES = 256
+
+def normalize_query(query):
+    # Queries differing only in case, Unicode form or whitespace share a cache entry
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+class RetrievalCache:
+    """Search results keyed by (user_id, query, top_k, mode) and tagged with the user's corpus version.
+
+    An entry is only served while the corpus version it was computed at is still current, so any write
+    that bumps the version retires every older entry for that user without a scan. Entries are evicted
+    least recently used first once their estimated size exceeds `max_bytes`; 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes=RETRIEVAL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, query, top_k, mode, version):
+        key = (user_id, query, top_k, mode)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, hits, size = entry
+                if entry_version == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return list(hits)
+                del self._entries[key]
+                self.bytes -= size
+                self.stale += 1
+            self.misses += 1
+            return None
+
+    def put(self, user_id, query, top_k, mode, version, hits):
+        if self.max_bytes <= 0:
+            return
+        key = (user_id, query, top_k, mode)
+        hits = tuple(hits)
+        size = ENTRY_OVERHEAD_BYTES + sys.getsizeof(query) + sum(
+            sys.getsizeof(chunk_id) + sys.getsizeof(text) + 64 for _, chunk_id, text in hits
+        )
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self._entries[key] = (version, hits, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.bytes
+            }
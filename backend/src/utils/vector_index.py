@@ -0,0 +1,264 @@
+import os
+import math
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+VECTOR_INDEX_MODE = os.getenv("VECTOR_INDEX_MODE", "exact")  # "exact" or "ivf"
+IVF_THRESHOLD = int(os.getenv("VECTOR_INDEX_IVF_THRESHOLD", "50000"))
+IVF_NPROBE = int(os.getenv("VECTOR_INDEX_IVF_NPROBE", "8"))
+MAX_CACHED_USERS = int(os.getenv("VECTOR_INDEX_MAX_USERS", "256"))
+
+_EPS = 1e-12
+# Caps the query x corpus score matrix materialized at once by search_many (~64MB of float32)
+MAX_SCORE_ELEMENTS = 16 * 1024 * 1024
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, _EPS)
+
+def _top_k(scores, k):
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[-1]:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(scores.shape[-1])
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+class VectorIndex:
+    """Cosine-similarity index over one user's chunks, stored as a contiguous float32 matrix."""
+
+    def __init__(self, dim, mode=VECTOR_INDEX_MODE, ivf_threshold=IVF_THRESHOLD, nprobe=IVF_NPROBE):
+        self.dim = dim
+        self.mode = mode
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.chunk_ids = []
+        self.texts = []
+        self.version = 0
+        # Maintained by VectorIndexRegistry: where the next incremental load starts and which rows past it it holds
+        self.watermark = 0
+        self.reset = None
+        self.unsettled = {}
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._size = 0
+        self._centroids = None
+        self._lists = None
+        self._ivf_built_at = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def vectors(self):
+        return self._vectors[:self._size]
+
+    def add(self, vectors, chunk_ids, texts):
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        n = vectors.shape[0]
+        if n == 0:
+            return
+        with self._lock:
+            needed = self._size + n
+            if needed > self._vectors.shape[0]:
+                # Grow geometrically so incremental inserts stay amortized O(1)
+                capacity = max(needed, 2 * self._vectors.shape[0], 64)
+                grown = np.empty((capacity, self.dim), dtype=np.float32)
+                grown[:self._size] = self._vectors[:self._size]
+                self._vectors = grown
+            start = self._size
+            self._vectors[start:needed] = vectors
+            self._size = needed
+            self.chunk_ids.extend(chunk_ids)
+            self.texts.extend(texts)
+            if self._centroids is not None:
+                if self._size > 2 * self._ivf_built_at:
+                    self._centroids = None
+                    self._lists = None
+                else:
+                    self._assign_to_lists(np.arange(start, needed), vectors)
+
+    def search(self, query, top_k=5):
+        query = _normalize(query).reshape(self.dim)
+        with self._lock:
+            if self._size == 0:
+                return []
+            candidates = self._ivf_candidates(query)
+            if candidates is None:
+                scores = self.vectors @ query
+                rows = _top_k(scores, top_k)
+                top_scores = scores[rows]
+            else:
+                scores = self._vectors[candidates] @ query
+                order = _top_k(scores, top_k)
+                rows = candidates[order]
+                top_scores = scores[order]
+            return [(float(score), self.chunk_ids[row], self.texts[row])
+                    for score, row in zip(top_scores, rows)]
+
+    def search_many(self, queries, top_k=5):
+        queries = _normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            if self._size == 0:
+                return [[] for _ in range(queries.shape[0])]
+            if self.mode == "ivf" and self._size >= self.ivf_threshold:
+                return [self.search(query, top_k) for query in queries]
+            k = min(top_k, self._size)
+            block = max(1, MAX_SCORE_ELEMENTS // self._size)
+            results = []
+            for start in range(0, queries.shape[0], block):
+                scores = queries[start:start + block] @ self.vectors.T
+                if k < self._size:
+                    rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                else:
+                    rows = np.broadcast_to(np.arange(self._size), scores.shape)
+                top_scores = np.take_along_axis(scores, rows, axis=1)
+                order = np.argsort(-top_scores, axis=1, kind="stable")
+                rows = np.take_along_axis(rows, order, axis=1)
+                top_scores = np.take_along_axis(top_scores, order, axis=1)
+                for row_ids, row_scores in zip(rows, top_scores):
+                    results.append([(float(score), self.chunk_ids[row], self.texts[row])
+                                    for score, row in zip(row_scores, row_ids)])
+            return results
+
+    # ----------------- Approximate (IVF) mode -----------------
+    def _ivf_candidates(self, query):
+        if self.mode != "ivf" or self._size < self.ivf_threshold:
+            return None
+        if self._centroids is None:
+            self._build_ivf()
+        nprobe = min(self.nprobe, self._centroids.shape[0])
+        probe = _top_k(self._centroids @ query, nprobe)
+        return np.concatenate([self._lists[i] for i in probe])
+
+    def _build_ivf(self, iterations=10, seed=0):
+        vectors = self.vectors
+        nlist = max(1, int(np.sqrt(self._size)))
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(self._size, size=min(self._size, nlist * 64), replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+        # Spherical k-means on a sample; vectors are unit length so dot product is cosine
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+        self._centroids = centroids
+        self._lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self._assign_to_lists(np.arange(self._size), vectors)
+        self._ivf_built_at = self._size
+        logging.info(f"Built IVF index with {nlist} lists over {self._size} vectors")
+
+    def _assign_to_lists(self, rows, vectors, block=65536):
+        assign = np.empty(len(rows), dtype=np.int64)
+        for start in range(0, len(rows), block):
+            assign[start:start + block] = np.argmax(vectors[start:start + block] @ self._centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(self._centroids.shape[0] + 1))
+        for i in range(self._centroids.shape[0]):
+            members = rows[order[bounds[i]:bounds[i + 1]]]
+            if len(members):
+                self._lists[i] = np.concatenate([self._lists[i], members])
+
+
+class CorpusState(namedtuple("CorpusState", ["version", "watermark", "reset"])):
+    """A user's corpus as seen by readers.
+
+    `version` changes on every write. Every chunk stamped at or below `watermark` is already stored,
+    while later stamps may still be in flight. `reset` changes when the chunks are replaced wholesale.
+    """
+
+
+class VectorIndexRegistry:
+    """Per-user vector indexes, loaded lazily on first use and kept in an LRU of bounded size.
+
+    `loader(user_id, after)` yields (row_id, stamp, chunk_id, text, embedding) for the user's chunks,
+    only those stamped above `after` unless it is None. A version change loads just those rows, and
+    only one thread per user loads at a time while the others wait for its result.
+    """
+
+    def __init__(self, loader, dim, max_users=MAX_CACHED_USERS):
+        self.loader = loader
+        self.dim = dim
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, state=None):
+        index = self._cached(user_id, state)
+        if index is not None:
+            return index
+        with self._lock:
+            load_lock = self._load_locks.setdefault(user_id, threading.Lock())
+        with load_lock:
+            # Whoever held the lock may already have caught the index up
+            index = self._cached(user_id, state)
+            if index is not None:
+                return index
+            with self._lock:
+                index = self._indexes.get(user_id)
+            if index is None or state is None or index.reset != state.reset:
+                index = self._load(user_id, state)
+            else:
+                self._catch_up(user_id, index, state)
+            with self._lock:
+                self._indexes[user_id] = index
+                self._indexes.move_to_end(user_id)
+                while len(self._indexes) > self.max_users:
+                    evicted, _ = self._indexes.popitem(last=False)
+                    self._load_locks.pop(evicted, None)
+        return index
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def _cached(self, user_id, state):
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                return None
+            if state is not None and (index.reset != state.reset or index.version < state.version):
+                return None
+            self._indexes.move_to_end(user_id)
+            return index
+
+    def _load(self, user_id, state):
+        index = VectorIndex(self.dim)
+        index.reset = state.reset if state else None
+        # Rows stamped above the watermark may be read again by the next catch-up, so they are remembered
+        index.watermark = state.watermark if state else math.inf
+        self._add_rows(index, self.loader(user_id, None))
+        index.version = state.version if state else 0
+        logging.info(f"Loaded vector index for user {user_id} with {len(index)} chunks")
+        return index
+
+    def _catch_up(self, user_id, index, state):
+        added = self._add_rows(index, self.loader(user_id, index.watermark))
+        index.watermark = state.watermark
+        index.unsettled = {row_id: stamp for row_id, stamp in index.unsettled.items() if stamp > state.watermark}
+        index.version = state.version
+        logging.info(f"Added {added} chunks to the vector index for user {user_id}")
+
+    def _add_rows(self, index, rows):
+        chunk_ids, texts, vectors = [], [], []
+        for row_id, stamp, chunk_id, text, embedding in rows:
+            if row_id in index.unsettled:
+                continue
+            if stamp > index.watermark:
+                index.unsettled[row_id] = stamp
+            chunk_ids.append(chunk_id)
+            texts.append(text)
+            vectors.append(embedding)
+        if vectors:
+            index.add(np.asarray(vectors, dtype=np.float32), chunk_ids, texts)
+        return len(vectors)
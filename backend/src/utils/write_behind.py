@@ -0,0 +1,146 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from pymongo.errors import BulkWriteError
+
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100"))
+WRITE_BEHIND_FLUSH_SECONDS = float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", "0.5"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+WRITE_BEHIND_ENQUEUE_TIMEOUT = float(os.getenv("WRITE_BEHIND_ENQUEUE_TIMEOUT", "1.0"))
+WRITE_BEHIND_MAX_RETRIES = 3
+
+_STOP = object()
+
+
+class _FlushMarker:
+    # Queued by flush(); set once every record enqueued ahead of it has been written
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class WriteBehindBuffer:
+    """Queues documents in-process and inserts them in batches from a background thread.
+
+    A batch is written once it reaches `max_batch` records or `flush_interval` seconds after its first
+    record arrived. The queue holds at most `max_pending` records: when Mongo falls behind, writers block
+    for up to `enqueue_timeout` seconds and then write synchronously. Pending records are flushed at exit.
+    """
+
+    def __init__(self, collection_getter, name, max_batch=WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval=WRITE_BEHIND_FLUSH_SECONDS, max_pending=WRITE_BEHIND_MAX_PENDING,
+                 enqueue_timeout=WRITE_BEHIND_ENQUEUE_TIMEOUT):
+        self.collection_getter = collection_getter
+        self.name = name
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+        self._pid = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def put(self, record):
+        self._ensure_started()
+        try:
+            self._queue.put(record, timeout=self.enqueue_timeout)
+        except queue.Full:
+            logging.warning(f"{self.name} write-behind queue full, writing synchronously")
+            self.collection_getter().insert_one(record)
+
+    def pending(self, predicate=lambda record: True):
+        # Records accepted but not yet confirmed written, oldest first
+        if self._pid != os.getpid():
+            return []
+        with self._queue.mutex:
+            queued = list(self._queue.queue)
+            in_flight = list(self._in_flight)
+        return [record for record in in_flight + queued
+                if record is not _STOP and not isinstance(record, _FlushMarker) and predicate(record)]
+
+    def flush(self):
+        # Waits only for records enqueued before the call, not for ones other writers keep adding
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        marker = _FlushMarker()
+        self._queue.put(marker)
+        marker.done.wait()
+
+    def close(self):
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Fresh queue and thread per process; neither survives a fork
+            self._queue = queue.Queue(maxsize=self.max_pending)
+            self._in_flight = []
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                self._queue.task_done()
+                break
+            if isinstance(first, _FlushMarker):
+                # Earlier batches are already written
+                first.done.set()
+                self._queue.task_done()
+                continue
+            # Visible to pending() while the batch is still being collected, not just while it is written
+            batch = self._in_flight = [first]
+            marker = None
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    record = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                if isinstance(record, _FlushMarker):
+                    marker = record
+                    break
+                batch.append(record)
+            self._write(batch)
+            self._in_flight = []
+            for _ in batch:
+                self._queue.task_done()
+            if marker is not None:
+                marker.done.set()
+                self._queue.task_done()
+
+    def _write(self, batch):
+        for attempt in range(WRITE_BEHIND_MAX_RETRIES + 1):
+            try:
+                self.collection_getter().insert_many(batch, ordered=False)
+                return
+            except BulkWriteError as e:
+                # Records that landed on an earlier attempt come back as duplicate keys
+                if all(error.get("code") == 11000 for error in e.details.get("writeErrors", [])):
+                    return
+                error = e
+            except Exception as e:
+                error = e
+            if attempt == WRITE_BEHIND_MAX_RETRIES:
+                logging.error(f"Dropping {len(batch)} {self.name} records after repeated failures: {str(error)}")
+                return
+            logging.warning(f"Error writing {self.name} batch, retrying: {str(error)}")
+            time.sleep(0.5 * 2 ** attempt)
@@ -12,17 +12,44 @@ import {
 } from '@mui/material';
 import UploadFileIcon from '@mui/icons-material/UploadFile';
 
+const POLL_INTERVAL_MS = 1000;
+// Give up if the job reports no progress for this long
+const POLL_STALL_TIMEOUT_MS = 5 * 60 * 1000;
+
 const UploadButton = ({ onUploadSuccess }) => {
   const theme = useTheme();
   const fileInputRef = useRef(null);
   const [uploading, setUploading] = useState(false);
   const [progress, setProgress] = useState(0);
   const [feedback, setFeedback] = useState({ open: false, type: 'success', message: '' });
+  const [indexing, setIndexing] = useState(false);
 
   const handleButtonClick = () => {
     if (!uploading) fileInputRef.current.click();
   };
 
+  // Large documents are indexed in the background; poll the job until it finishes
+  const pollJob = async (statusUrl) => {
+    let lastUpdate = null;
+    let deadline = Date.now() + POLL_STALL_TIMEOUT_MS;
+    while (Date.now() < deadline) {
+      const res = await fetch(statusUrl);
+      if (!res.ok) throw new Error('Failed to check indexing status.');
+      const job = await res.json();
+      if (job.status === 'completed') return job;
+      if (job.status === 'failed') throw new Error(job.error || 'Indexing failed.');
+      if (job.updated_at !== lastUpdate) {
+        lastUpdate = job.updated_at;
+        deadline = Date.now() + POLL_STALL_TIMEOUT_MS;
+      }
+      if (job.total_chunks) {
+        setProgress(Math.round((job.chunks_indexed * 100) / job.total_chunks));
+      }
+      await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+    }
+    throw new Error('Indexing is taking too long. Check the document list again later.');
+  };
+
   const handleFileChange = async (e) => {
     const file = e.target.files[0];
     if (!file) return;
@@ -42,7 +69,28 @@ const UploadButton = ({ onUploadSuccess }) => {
       }
     };
 
-    xhr.onload = () => {
+    xhr.onload = async () => {
+      if (xhr.status === 202) {
+        const result = JSON.parse(xhr.responseText);
+        setIndexing(true);
+        setProgress(0);
+        try {
+          await pollJob(result.status_url);
+          setFeedback({
+            open: true,
+            type: 'success',
+            message: 'Document uploaded and indexed!',
+          });
+          if (onUploadSuccess) onUploadSuccess(result);
+        } catch (err) {
+          setFeedback({ open: true, type: 'error', message: err.message });
+        }
+        setIndexing(false);
+        setUploading(false);
+        setProgress(0);
+        e.target.value = '';
+        return;
+      }
       setUploading(false);
       setProgress(0);
       if (xhr.status === 200 || xhr.status === 201) {
@@ -132,6 +180,11 @@ const UploadButton = ({ onUploadSuccess }) => {
       />
       {uploading && (
         <Box sx={{ width: 180, mt: 1 }}>
+          {indexing && (
+            <Box component="span" sx={{ fontSize: 12, color: theme.palette.text.secondary }}>
+              Indexing...
+            </Box>
+          )}
           <LinearProgress
             variant="determinate"
             value={progress}